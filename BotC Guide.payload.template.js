@@ -0,0 +1,131 @@
+      // The nodes come as data, {"types": [character types], "nodes": [[question, answer, types, sort key], ...]}
+      // in page order, with bit i of types set if the node mentions a character of types[i].
+      // Only the nodes that match are put in the page, a few at a time as they scroll into view.
+      // The functions below take the place of those of the same name that work on nodes already in the page.
+      var payload = PAYLOAD_PLACEHOLDER;
+
+      const renderAhead = 1500; // how far below the window nodes are put in the page, in pixels
+      const renderBatch = 20;
+      const sentinel = document.createElement("div");
+      main.appendChild(sentinel);
+
+      let matching = payload.nodes.map((node, index) => index);
+      let rendered = 0;
+      let highlightRegexes = [];
+
+
+      function highlight(html) {
+        highlightRegexes.forEach(termRegex => {
+          html = html.replace(termRegex, '<span class="highlight">$1</span>');
+        });
+        return html;
+      }
+
+
+      function renderNode(index) {
+        const [question, answer] = payload.nodes[index];
+        const node = document.createElement("div");
+        node.className = "node";
+        node.innerHTML = '<h4 class="question">' + highlight(question) + '</h4><div class="answer">' + highlight(answer) + '</div>';
+        main.insertBefore(node, sentinel);
+      }
+
+
+      // Adds matching nodes until there are enough to fill the window and a little more
+      function renderVisible() {
+        while (rendered < matching.length && sentinel.getBoundingClientRect().top < window.innerHeight + renderAhead) {
+          const end = Math.min(rendered + renderBatch, matching.length);
+          for (; rendered < end; rendered++) {
+            renderNode(matching[rendered]);
+          }
+        }
+      }
+
+
+      function indexedNodes(term) {
+        if (!Object.prototype.hasOwnProperty.call(keywordNodes, term))
+          return null;
+
+        const entry = keywordNodes[term];
+        if (Array.isArray(entry))
+          return new Set(entry);
+
+        const bits = atob(entry); // a bitset, one bit per node
+        const found = new Set();
+        for (let index = 0; index < payload.nodes.length; index++) {
+          if (bits.charCodeAt(index >> 3) & (1 << (index & 7)))
+            found.add(index);
+        }
+        return found;
+      }
+
+
+      function updateFiltering() {
+        var filterTerms0 = keywordInput.value.split(',').filter(Boolean);
+        filterTerms0 = filterTerms0.filter(entry => entry.trim() != ''); // remove empty strings
+        const filterTerms = filterTerms0.map(str => str.trim());
+
+        // When every term is indexed there is no need to search each node
+        const indexed = filterTerms.map(indexedNodes);
+        const useIndex = indexed.every(Boolean);
+
+        matching = [];
+        payload.nodes.forEach(([question, answer], index) => {
+          const allMandatoryPresent = useIndex ? indexed.every(found => found.has(index)) : filterTerms.every(term => {
+            if (term.includes('|')) { // Handle optional terms
+              const subTerms = term.split('|').map(s => s.trim());
+              return subTerms.some(subTerm => {
+                const termRegex = buildRegex(subTerm);
+                return question.match(termRegex) || answer.match(termRegex);
+              });
+            } else { // Handle mandatory terms
+              const termRegex = buildRegex(term);
+              return question.match(termRegex) || answer.match(termRegex);
+            }
+          });
+          if (allMandatoryPresent) {
+            matching.push(index);
+          }
+        });
+
+        highlightRegexes = filterTerms.reduce((result, str) => result.concat(str.split('|').map(s => s.trim())), []).map(buildRegex).filter(Boolean);
+        main.querySelectorAll('.node').forEach(node => node.remove());
+        rendered = 0;
+        renderVisible();
+      }
+
+
+      function handleZeroMatches(count) {
+        if (selectedKeywordsContainer.childElementCount == 0) {
+          return;
+        }
+
+        info.textContent = "";
+        info.style.display = "none";
+        if (matching.length == 0) {
+          info.textContent = "Oh no! Nothing found.";
+          info.style.display = "block";
+        }
+      }
+
+
+      function addTransition() {
+        let count = 1;
+        main.querySelectorAll('.node').forEach(node => {
+          node.classList.add('shifted');
+          setTimeout(() => {
+            node.classList.add('shift');
+          }, count * 50);
+          setTimeout(() => {
+            node.classList.remove('shift');
+            node.classList.remove('shifted');
+          }, count * 50 + 1000);
+          count = Math.min(++count, 12);
+        });
+      }
+
+
+      // The body scrolls rather than the window, which the observer does not mind
+      new IntersectionObserver(renderVisible, {rootMargin: `0px 0px ${renderAhead}px 0px`}).observe(sentinel);
+      window.addEventListener("resize", renderVisible);
+      renderVisible();
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Benchmarks the guide build.
+Generates BotC.txt corpora at several scales, runs update guide.py on each
+with --profile-json and collects the per-stage timings and peak memory.
+Output is a JSON file that can be compared with an earlier run.
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+UPDATE_SCRIPT = os.path.join(HERE, "update guide.py")
+
+
+def load_guide():
+    # The build script's name has a space in it, so it cannot simply be imported
+    spec = importlib.util.spec_from_file_location("update_guide", UPDATE_SCRIPT)
+    guide = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(guide)
+    return guide
+
+
+def synthesise_corpus(source: str, scale: int, seed: int = 0) -> str:
+    """
+    The original corpus followed by scale - 1 copies in which every role mentioned
+    is swapped for a random role of the same type, so the role density stays realistic.
+    """
+    guide = load_guide()
+    keywords = guide.load_keywords(os.path.join(HERE, guide.KEYWORDS_FILE), os.path.join(HERE, guide.KEYWORDS_CACHE_FILE))
+    pattern, role_types = re.compile(keywords["pattern"]), keywords["role types"]
+    roles_by_type = {}
+    for role, character_type in role_types.items():
+        roles_by_type.setdefault(character_type, []).append(role)
+
+    rng = random.Random(seed)
+
+    def swap_role(match):
+        word = match.group(0)
+        suffix = ""
+        if word.endswith('s') and word[:-1] in role_types:
+            word, suffix = word[:-1], "s"
+        return rng.choice(roles_by_type[role_types[word]]) + suffix
+
+    copies = [source]
+    for _ in range(scale - 1):
+        copies.append(pattern.sub(swap_role, source))
+    return "\n".join(copies)
+
+
+def run_build(directory: str, jobs: int) -> 'tuple[list[dict], float]':
+    profile_path = os.path.join(directory, "profile.json")
+    command = [sys.executable, UPDATE_SCRIPT, "--profile-json", profile_path, "--jobs", str(jobs)]
+
+    start = time.perf_counter()
+    subprocess.run(command, cwd=directory, check=True, stdout=subprocess.DEVNULL)
+    elapsed = time.perf_counter() - start
+
+    with open(profile_path, 'r', encoding="utf-8") as file:
+        return json.load(file), elapsed
+
+
+def benchmark(scales: 'list[int]', jobs: int, memory_budget: float) -> dict:
+    with open(os.path.join(HERE, "BotC.txt"), 'r', encoding="utf-8") as file:
+        source = file.read()
+
+    runs = []
+    over_budget = []
+    for scale in scales:
+        print(f"Scale {scale}x ...")
+        with tempfile.TemporaryDirectory() as directory:
+            corpus = synthesise_corpus(source, scale)
+            with open(os.path.join(directory, "BotC.txt"), 'w', encoding="utf-8") as file:
+                file.write(corpus)
+            shutil.copy(os.path.join(HERE, "BotC Guide.template.html"), directory)
+            shutil.copy(os.path.join(HERE, "BotC keywords.json"), directory)
+
+            stages, elapsed = run_build(directory, jobs)
+            runs.append({"scale": scale,
+                         "questions": sum(1 for line in corpus.split("\n") if line.startswith("Q ")),
+                         "corpus_bytes": len(corpus.encode('utf-8')),
+                         "guide_bytes": os.path.getsize(os.path.join(directory, "BotC Guide.html")),
+                         "elapsed_seconds": elapsed,
+                         "peak_rss_bytes": stages[-1].get("peak_rss_bytes") if stages else None,
+                         "stages": stages})
+        if not print_run(runs[-1], memory_budget):
+            over_budget.append(scale)
+
+    return {"created": datetime.now().isoformat(timespec='seconds'),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "jobs": jobs,
+            "memory_budget_mb": memory_budget,
+            "over_budget_scales": over_budget,
+            "runs": runs}
+
+
+def print_run(run: dict, memory_budget: float) -> bool:
+    # Returns False if the build went over the memory budget
+    over = False
+    print(f"  {run['questions']} questions, {run['corpus_bytes'] / 2**20:.1f} MB in, "
+          f"{run['guide_bytes'] / 2**20:.1f} MB out, {run['elapsed_seconds']:.1f} s")
+    if run["peak_rss_bytes"] is not None:
+        peak = run["peak_rss_bytes"] / 2**20
+        over = peak > memory_budget
+        flag = f"  <-- over the budget of {memory_budget:g} MB" if over else ""
+        print(f"  Peak resident memory {peak:.1f} MB{flag}")
+    print(f"  {'Stage':<26}{'Wall (s)':>10}{'CPU (s)':>10}{'Peak (MB)':>11}")
+    for stage in run["stages"]:
+        print(f"  {stage['stage']:<26}{stage['wall_seconds']:>10.3f}{stage['cpu_seconds']:>10.3f}{stage['peak_bytes'] / 2**20:>11.1f}")
+    return not over
+
+
+def compare(previous: dict, current: dict) -> None:
+    print("Compared with " + previous["created"] + ":")
+    earlier_runs = {run["scale"]: run for run in previous["runs"]}
+    for run in current["runs"]:
+        earlier = earlier_runs.get(run["scale"])
+        if earlier is None:
+            continue
+        earlier_stages = {stage["stage"]: stage for stage in earlier["stages"]}
+        print(f"  Scale {run['scale']}x")
+        for stage in run["stages"]:
+            before = earlier_stages.get(stage["stage"])
+            if before is None or before["wall_seconds"] == 0:
+                continue
+            ratio = stage["wall_seconds"] / before["wall_seconds"]
+            flag = "  <-- slower" if ratio > 1.2 else ""
+            print(f"    {stage['stage']:<26}{before['wall_seconds']:>9.3f} s ->{stage['wall_seconds']:>9.3f} s  x{ratio:.2f}{flag}")
+
+
+def main() -> None:
+    arguments = argparse.ArgumentParser(description="Benchmarks update guide.py on synthetic corpora.")
+    arguments.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100], help="corpus sizes, as multiples of BotC.txt")
+    arguments.add_argument('--jobs', type=int, default=1, metavar='N', help="passed on to update guide.py")
+    arguments.add_argument('--memory-budget', type=float, default=384, metavar='MB',
+                           help="peak resident memory any one build should stay under, tracemalloc's own overhead included")
+    arguments.add_argument('--output', default=f"benchmark-{datetime.now().strftime('%Y%m%d_%H%M%S')}.json", help="where to save the results")
+    arguments.add_argument('--compare', metavar='PATH', help="results of an earlier run to compare against")
+    options = arguments.parse_args()
+
+    results = benchmark(options.scales, options.jobs, options.memory_budget)
+    with open(options.output, 'w', encoding="utf-8") as file:
+        json.dump(results, file, indent=2)
+    print("Saved results to " + options.output)
+
+    if options.compare:
+        with open(options.compare, 'r', encoding="utf-8") as file:
+            compare(json.load(file), results)
+
+    if results["over_budget_scales"]:
+        sys.exit(f"Over the memory budget of {options.memory_budget:g} MB at "
+                 + ", ".join(f"{scale}x" for scale in results["over_budget_scales"]) + ", oh dear!")
+
+
+if __name__ == "__main__":
+    main()
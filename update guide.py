@@ -3,39 +3,162 @@
 Updates the guide.
 Takes the data from BotC.txt.
 Injects the appropriate HTML tags and tries to make it pretty.
-Output is an updated BotC Guide.html file.
+Output is an updated BotC Guide.html file, built from the page shell in BotC Guide.template.html.
 """
 
-from bs4 import BeautifulSoup
 import re
 import json
 import sys
 import os
-import shutil
+import hashlib
+import base64
+import bisect
+import zlib
+import random
+import pickle
+import argparse
+import functools
+import itertools
+import contextlib
+import time
+import tracemalloc
+import tempfile
+import threading
+from array import array
+from collections import deque
 from datetime import datetime
+from html import unescape
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator
 
-# pip install --trusted-host pypi.org --trusted-host files.pythonhosted.org pip install yattag
-# pip install beautifulsoup4
-from yattag import indent as yattag_indent
+if TYPE_CHECKING:   # only imported where they are used, as most runs never need them
+    import asyncio
+    import sqlite3
+
+# zstd is optional: it is in the standard library from Python 3.14, or pip install zstandard
+try:
+    from compression import zstd
+except ImportError:
+    try:
+        import zstandard as zstd
+    except ImportError:
+        zstd = None
+
+# resource is not there on Windows, where the peak memory goes unreported
+try:
+    import resource
+except ImportError:
+    resource = None
 
 
 BOTC_DATA_FILE = "BotC.txt"
 RESULT_FILE = "BotC Guide.html"
+TEMPLATE_FILE = "BotC Guide.template.html"
+KEYWORDS_FILE = "BotC keywords.json"
+KEYWORDS_CACHE_FILE = "BotC keywords.cache.pickle"
+TEMPLATE_MARKERS = ("\nNODES_PLACEHOLDER", "KEYWORDS_PLACEHOLDER", "KEYWORD_NODES_PLACEHOLDER", "ROLE_PAIRS_PLACEHOLDER",
+                    "RELATED_NODES_PLACEHOLDER", "\nPAYLOAD_SCRIPT_PLACEHOLDER")
+TEMPLATE_MARKER = re.compile('(' + '|'.join(re.escape(marker) for marker in TEMPLATE_MARKERS) + ')')
+MINIFIED_FILE = "BotC Guide.min.html"
+PAYLOAD_FILE = "BotC Guide.payload.html"
+PAYLOAD_TEMPLATE_FILE = "BotC Guide.payload.template.js"
+BUILD_CACHE_FILE = "BotC Guide.cache.jsonl"
+DATABASE_FILE = "BotC Guide.sqlite"
+PAGES_DIR = "characters"
+DEDUPE_REPORT_FILE = "BotC Guide.duplicates.txt"
 DEBUG_MODE = False
-MAX_BACKUPS = 5
-
-
-def debug(data: str, output_path: str) -> None:
+BACKUP_DIR = "backups"
+MAX_BACKUPS = 20
+BACKUP_KEYFRAME_INTERVAL = 8     # every so many backups one is stored whole, so a restore never has far to go
+DELTA_CANDIDATES = 8             # earlier copies of a line tried when looking for the longest run to copy
+WATCH_INTERVAL = 0.1             # seconds between looks at BotC.txt in --watch mode
+WATCH_DEBOUNCE = 0.2             # how long BotC.txt has to stay unchanged before a rebuild
+SERVE_PORT = 8000
+SERVE_CACHE_SIZE = 1024          # searches whose results the server keeps
+SERVE_LATENCY_WINDOW = 10_000    # the most recent requests the latency percentiles are taken over
+ZSTD_LEVEL = 19
+KEYWORD_NODES_BUDGET = 200_000   # bytes the keyword to node index may add to the page
+RELATED_NODES = 3                # questions listed under "See also" for each node
+NODE_INDENT_LEVEL = 3            # nodes sit in <html><body><main>
+SPOOL_BATCH = 256                # nodes searched for keywords at a time before they go to the spool
+CHUNK_SIZE = 2**20               # bytes read at a time when copying a written guide
+MINHASH_PRIME = 2**31 - 1        # small enough that a * x + b fits in 64 bits, for NumPy
+MINHASH_HASHES = 120             # per question, in DEDUPE_BANDS bands of equal size
+DEDUPE_BANDS = 40                # questions 45% alike share a band 98% of the time: 1 - (1 - 0.45 ** 3) ** 40
+DEDUPE_THRESHOLD = 0.45          # how much of their word pairs two questions share to count as asking the same
+
+
+def debug(data: 'str | Callable[[], str]', output_path: str) -> None:
     if not DEBUG_MODE:
         return
 
+    # Expensive interim results are passed as a callable so they are only built when needed
+    if callable(data):
+        data = data()
+
     print("  - Saving interim results to " + output_path)
     with open(output_path, 'w', encoding="utf-8") as file:
         file.writelines(data)
 
 
-def sanity_check():
-    for f in [BOTC_DATA_FILE, RESULT_FILE]:
+def peak_rss() -> 'int | None':
+    # The most memory the process has had resident at once, in bytes
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024   # macOS counts in bytes, Linux in kilobytes
+
+
+class StageProfiler:
+    """
+    Records wall time, CPU time and the tracemalloc peak of each build stage when profiling,
+    along with the process's peak resident memory by the end of the stage.
+    """
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self.stages = []
+        if enabled:
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> 'Iterator[None]':
+        if not self.enabled:
+            yield
+            return
+
+        tracemalloc.reset_peak()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            self.stages.append({"stage": name,
+                                "wall_seconds": time.perf_counter() - wall,
+                                "cpu_seconds": time.process_time() - cpu,
+                                "peak_bytes": tracemalloc.get_traced_memory()[1],
+                                "peak_rss_bytes": peak_rss()})
+
+    def peak_bytes(self) -> int:
+        return max((stage['peak_bytes'] for stage in self.stages), default=0)
+
+    def table(self) -> str:
+        def rss(stage: dict) -> str:
+            return "-" if stage['peak_rss_bytes'] is None else f"{stage['peak_rss_bytes'] / 2**20:.1f}"
+
+        lines = [f"  {'Stage':<26}{'Wall (s)':>10}{'CPU (s)':>10}{'Peak (MB)':>11}{'RSS (MB)':>10}"]
+        for stage in self.stages:
+            lines.append(f"  {stage['stage']:<26}{stage['wall_seconds']:>10.3f}{stage['cpu_seconds']:>10.3f}"
+                         f"{stage['peak_bytes'] / 2**20:>11.1f}{rss(stage):>10}")
+        lines.append(f"  {'total':<26}{sum(stage['wall_seconds'] for stage in self.stages):>10.3f}"
+                     f"{sum(stage['cpu_seconds'] for stage in self.stages):>10.3f}"
+                     f"{self.peak_bytes() / 2**20:>11.1f}{rss(self.stages[-1]) if self.stages else '-':>10}")
+        return "\n".join(lines)
+
+    def save(self, path: str) -> None:
+        with open(path, 'w', encoding="utf-8") as file:
+            json.dump(self.stages, file, indent=2)
+
+
+def sanity_check(payload: bool = False):
+    for f in [BOTC_DATA_FILE, TEMPLATE_FILE, KEYWORDS_FILE] + ([PAYLOAD_TEMPLATE_FILE] if payload else []):
         if os.path.exists(f):
             print(f"  {f} exists.")
         else:
@@ -44,83 +167,539 @@ def sanity_check():
     return True
 
 
-def check_output_file_format(input_file: str) -> bool:
-    with open(input_file, 'r', encoding='utf-8') as f:
-        soup = BeautifulSoup(f, 'html.parser')
-    
-    main = soup.find('main')
-    
-    if main is None:
-        print("  " + RESULT_FILE + "is incorrectly formatted: No <main> element found.")
-        return False
-    print("  " + RESULT_FILE + " is correctly formatted.")
+def check_template(template: 'list[str]') -> bool:
+    for marker in TEMPLATE_MARKERS:
+        count = template.count(marker)
+        if count != 1:
+            print(f"  {TEMPLATE_FILE} is incorrectly formatted: {marker.strip()} found {count} times, instead of once.")
+            return False
+    print("  " + TEMPLATE_FILE + " is correctly formatted.")
     return True
 
 
-def check_file_format(file_path: str) -> bool:
+def read_blocks(file_path: str, errors: 'list[tuple[int, str]]') -> 'Iterator[tuple[list[str], bool]]':
+    """
+    Streams the file one question-answer block at a time, checking that Q and A lines
+    alternate along the way. Every problem found is added to errors with its line number.
+    The first block holds whatever comes before the first question.
+    Yields each block's lines and whether it is the last block.
+    """
+    last_letter = None
+    block = []
+    line_number = 0
+
     with open(file_path, 'r', encoding="utf-8") as file:
-        lines = file.readlines()
-
-        file_name = file_path.split("/")[-1]
-        first_letters = ""
-
-        for line_number, line in enumerate(lines, start=1):
-            if line:
-                first_char = line[0]
-                if first_char not in {'Q', 'A'}:
-                    continue
-                if first_char == 'A' and 'Q' not in first_letters:
-                    print(f"  {file_name} is incorrectly formatted: 'A' detected before 'Q' on line {line_number}.")
-                    return False
-                if first_letters and first_char == first_letters[-1]:
-                    print(f"  {file_name} is incorrectly formatted: '{first_char}' detected after another '{first_char}' on line {line_number}.")
-                    return False
-
-                first_letters += first_char
-
-        if first_letters and first_letters[-1] == 'A':
-            print(f"  {file_name} is correctly formatted.")
-            return True
+        for line_number, line in enumerate(file, start=1):
+            first_char = line[:1]
+            if first_char in {'Q', 'A'}:
+                if first_char == 'A' and last_letter is None:
+                    errors.append((line_number, "'A' detected before 'Q'"))
+                elif first_char == last_letter:
+                    errors.append((line_number, f"'{first_char}' detected after another '{first_char}'"))
+                last_letter = first_char
+
+            if line.startswith('Q '):
+                yield block, False
+                block = []
+            block.append(line)
+
+    if last_letter != 'A':
+        errors.append((line_number, "Missing 'A' at the end"))
+    yield block, True
+
+
+def line_delta(base: str, text: str) -> list:
+    """
+    The text as runs of lines copied from base, given as [first line, line count], and strings of new lines.
+    Lines are matched by hashing, so moved nodes are found wherever they went.
+    """
+    base_lines = base.splitlines(keepends=True)
+    positions = {}
+    for index, line in enumerate(base_lines):
+        positions.setdefault(line, []).append(index)
+
+    lines = text.splitlines(keepends=True)
+    delta = []
+    new_lines = []
+    following = 0      # the line after the last run copied, which usually carries on
+    index = 0
+    while index < len(lines):
+        if following < len(base_lines) and base_lines[following] == lines[index]:
+            candidates = [following]
         else:
-            print(f"  {file_name} is incorrectly formatted: Missing 'A' at the end.")
-            return False
+            candidates = positions.get(lines[index], [])[:DELTA_CANDIDATES]
+
+        best_start, best_count = 0, 0
+        for start in candidates:
+            count = 1
+            while (index + count < len(lines) and start + count < len(base_lines)
+                   and base_lines[start + count] == lines[index + count]):
+                count += 1
+            if count > best_count:
+                best_start, best_count = start, count
+
+        if best_count:
+            if new_lines:
+                delta.append(''.join(new_lines))
+                new_lines = []
+            delta.append([best_start, best_count])
+            index += best_count
+            following = best_start + best_count
+        else:
+            new_lines.append(lines[index])
+            index += 1
+    if new_lines:
+        delta.append(''.join(new_lines))
+    return delta
+
+
+def apply_delta(base: str, delta: list) -> str:
+    base_lines = base.splitlines(keepends=True)
+    return ''.join(''.join(base_lines[part[0]:part[0] + part[1]]) if isinstance(part, list) else part for part in delta)
+
+
+class BackupStore:
+    """
+    Earlier versions of the guide, in a directory of their own. Each version is stored once, under the
+    hash of its content, zlib-compressed either whole or as a delta against the version backed up before it.
+    An index lists the backups oldest first and says how each version is stored, so listing, pruning
+    and restoring never scan the directory.
+    """
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.index_path = os.path.join(directory, "index.json")
+        self.backups = []   # {"timestamp", "hash", "size"}, oldest first
+        self.objects = {}   # hash: {"base": hash of the version the delta is against, or None if stored whole, "stored": bytes}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r', encoding="utf-8") as file:
+                index = json.load(file)
+            self.backups, self.objects = index["backups"], index["objects"]
+
+    def object_path(self, digest: str) -> str:
+        return os.path.join(self.directory, digest + ".z")
+
+    def depth(self, digest: str) -> int:
+        # How many deltas lie between the version and one stored whole
+        depth = 0
+        while self.objects[digest]["base"] is not None:
+            digest = self.objects[digest]["base"]
+            depth += 1
+        return depth
+
+    def read(self, digest: str) -> str:
+        with open(self.object_path(digest), 'rb') as file:
+            data = zlib.decompress(file.read()).decode('utf-8')
+        base = self.objects[digest]["base"]
+        if base is None:
+            return data
+        return apply_delta(self.read(base), json.loads(data))
+
+    def store(self, digest: str, text: str, base: 'str | None') -> None:
+        data = text if base is None else json.dumps(line_delta(self.read(base), text))
+        if len(data) > len(text) // 2:     # too little in common to be worth a delta
+            data, base = text, None
+        stored = write_atomically(self.object_path(digest), [zlib.compress(data.encode('utf-8'), 9)], 'wb')
+        self.objects[digest] = {"base": base, "stored": stored}
+
+    def add(self, path: str) -> 'tuple[dict | None, int]':
+        # Returns the new backup and the bytes it took, or None if the file is the same as the latest backup
+        with open(path, 'r', encoding="utf-8", newline='') as file:
+            text = file.read()
+        digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        latest = self.backups[-1]["hash"] if self.backups else None
+        if digest == latest:
+            return None, 0
+
+        os.makedirs(self.directory, exist_ok=True)
+        stored = 0
+        if digest not in self.objects:    # a version seen before takes no more space
+            keyframe = latest is None or self.depth(latest) + 1 >= BACKUP_KEYFRAME_INTERVAL
+            self.store(digest, text, None if keyframe else latest)
+            stored = self.objects[digest]["stored"]
+
+        backup = {"timestamp": datetime.now().strftime("%Y%m%d_%H%M%S"), "hash": digest, "size": len(text.encode('utf-8'))}
+        self.backups.append(backup)
+        self.prune()
+        self.save()
+        return backup, stored
+
+    def prune(self) -> 'list[dict]':
+        pruned = []
+        while len(self.backups) > MAX_BACKUPS:
+            backup = self.backups.pop(0)
+            pruned.append(backup)
+            digest = backup["hash"]
+            if any(other["hash"] == digest for other in self.backups):
+                continue
+            # Versions stored as deltas against this one are stored whole instead
+            for other, stored in list(self.objects.items()):
+                if stored["base"] == digest:
+                    self.store(other, self.read(other), None)
+            os.remove(self.object_path(digest))
+            del self.objects[digest]
+        return pruned
+
+    def save(self) -> None:
+        write_atomically(self.index_path, [json.dumps({"backups": self.backups, "objects": self.objects}, indent=2)])
+
+    def find(self, timestamp: str) -> 'dict | None':
+        for backup in reversed(self.backups):
+            if backup["timestamp"] == timestamp:
+                return backup
+        return None
+
+    def space(self) -> 'tuple[int, int]':
+        # The bytes the backups would take as copies, and the bytes they take in the store
+        stored = sum(entry["stored"] for entry in self.objects.values())
+        if os.path.exists(self.index_path):
+            stored += os.path.getsize(self.index_path)
+        return sum(backup["size"] for backup in self.backups), stored
+
+
+def space_saved(store: BackupStore) -> str:
+    copies, stored = store.space()
+    saved = 1 - stored / copies if copies else 0
+    return f"{len(store.backups)} backups, {stored:,} bytes instead of {copies:,} as copies ({saved:.1%} saved)"
+
+
+def describe_format_errors(file_path: str, errors: 'list[tuple[int, str]]') -> str:
+    file_name = os.path.basename(file_path)
+    return "\n".join(f"  {file_name} is incorrectly formatted: {problem} on line {line_number}." for line_number, problem in errors)
+
+
+LINT_CAPITALISED = re.compile(r"(?<![A-Za-z'-])[A-Z][A-Za-z'-]*")
+LINT_NEXT_WORD = re.compile(r"\s+([A-Za-z][A-Za-z'-]*)")
+LINT_INVISIBLE = re.compile('[\u00ad\u200b-\u200f\u2028\u2029\u2060\ufeff]')
+
+
+def edit_allowance(word: str) -> int:
+    # How many edits a word can be from a role's word and still look like a misspelling of it.
+    # Short words are only told apart from roles by their case, as plenty of English is a letter away from a Sage or a Witch.
+    return 2 if len(word) >= 8 else 1 if len(word) >= 6 else 0
+
+
+def deletions(word: str, edits: int) -> 'set[str]':
+    variants = {word}
+    latest = {word}
+    for _ in range(edits):
+        latest = {variant[:i] + variant[i + 1:] for variant in latest for i in range(len(variant))}
+        variants |= latest
+    return variants
+
+
+def edit_distance(a: str, b: str) -> int:
+    # Levenshtein distance, with swapping two neighbouring letters counting as one edit
+    previous, current = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        before, previous, current = previous, current, [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], before[j - 2] + 1)
+    return current[-1]
+
+
+@functools.lru_cache(maxsize=None)
+def role_spellings() -> 'tuple[dict[str, set[str]], dict[str, list[list[str]]]]':
+    """
+    The index near_role_words looks words up in: every word of every role name, lowercased and with
+    up to its edit_allowance of letters deleted. A misspelling and the word it was meant to be
+    always have a deletion in common, so finding them needs no comparing against every role.
+    Also returns the words of the roles, by their first word.
+    """
+    deleted = {}
+    starting = {}
+    for role in role_matcher()[1]:
+        words = role.split(' ')
+        starting.setdefault(words[0].lower(), []).append(words)
+        for word in words:
+            for variant in deletions(word.lower(), edit_allowance(word)):
+                deleted.setdefault(variant, set()).add(word.lower())
+    return deleted, starting
+
+
+@functools.lru_cache(maxsize=None)
+def near_role_words(word: str) -> 'frozenset[str]':
+    # The lowercased words of role names that the word is, or looks like a misspelling of.
+    # Misspellings seldom get the first letter wrong, and allowing that finds "Night" for "Knight".
+    lowered = word.lower()
+    deleted = role_spellings()[0]
+    candidates = set()
+    for variant in deletions(lowered, edit_allowance(lowered)):
+        candidates |= deleted.get(variant, set())
+    return frozenset(candidate for candidate in candidates
+                     if candidate[0] == lowered[0] and edit_distance(lowered, candidate) <= edit_allowance(candidate))
+
+
+def bare_word(word: str) -> str:
+    # The word without a possessive ending
+    if word.endswith("'s"):
+        return word[:-2]
+    return word.rstrip("'")
+
+
+@functools.lru_cache(maxsize=None)
+def roles_starting_like(word: str) -> 'tuple[list[str], ...]':
+    # The words of each role whose name starts with the capitalised word, or with what it looks like a misspelling of
+    if len(word) > 1 and word.isupper():    # shouting, not naming
+        return ()
+    word = bare_word(word)
+    role_types = role_matcher()[1]
+    if word in role_types or word.endswith('s') and word[:-1] in role_types:
+        return ()       # a role in full, and no role's name starts with the name of another
+    first_words = near_role_words(word)
+    if word.endswith('s'):
+        first_words |= near_role_words(word[:-1])
+    starting = role_spellings()[1]
+    return tuple(role_words for first_word in first_words for role_words in starting.get(first_word, ()))
+
+
+def lint_roles(line: str, alternatives: 'set[str]') -> 'list[str]':
+    # Capitalised words and phrases that look like role names, but are not quite, so go unhighlighted
+    problems = []
+    if not any(map(roles_starting_like, LINT_CAPITALISED.findall(line))):     # as with almost every line
+        return problems
+    for match in LINT_CAPITALISED.finditer(line):
+        candidates = roles_starting_like(match.group(0))
+        if not candidates:
+            continue
+
+        closest = None
+        for role_words in candidates:
+            written = [match.group(0)]
+            position = match.end()
+            while len(written) < len(role_words):
+                following = LINT_NEXT_WORD.match(line, position)
+                if following is None:
+                    break
+                written.append(following.group(1))
+                position = following.end()
+            if len(written) != len(role_words):
+                continue
+
+            # A role is highlighted with an s on the end too, and a possessive ends where the name does
+            written[-1] = bare_word(written[-1])
+            if written == role_words or written[:-1] == role_words[:-1] and written[-1] == role_words[-1] + 's':
+                closest = None
+                break
+            if all(written_word.lower() in (expected.lower(), expected.lower() + 's') or expected.lower() in near_role_words(written_word)
+                   for written_word, expected in zip(written, role_words)):
+                phrase, role = ' '.join(written), ' '.join(role_words)
+                if closest is None or edit_distance(phrase, role) < edit_distance(*closest):
+                    closest = (phrase, role)
+
+        if closest is not None and closest[0].lower() not in alternatives:
+            phrase, role = closest
+            problems.append(f"'{phrase}' looks like the {role_matcher()[1][role]} '{role}', but is not written the same so is not highlighted")
+    return problems
+
+
+def lint_emphasis(text: str) -> 'list[str]':
+    # Underscores that emphasise would leave alone or pair up wrongly
+    problems = []
+    for match in EMPHASIS.finditer(text):
+        if text[match.start() - 1:match.start()].isalnum() or text[match.end():match.end() + 1].isalnum():
+            problems.append(f"'{match.group(0)}' is emphasised from an underscore inside a word")
+    if '_' in EMPHASIS.sub('', text):
+        problems.append("an '_' has nothing to pair with, so it will show as it is")
+    return problems
+
+
+def lint(file_path: str) -> 'list[tuple[int, str]]':
+    """
+    Everything wrong with BotC.txt that can be found without building the guide, in one pass:
+    the Q and A structure, lines the parser would take for something else, emphasis, lists and
+    role names that are slightly off. Returns each problem with its line number, in line order.
+    """
+    problems = []
+    role_types = role_matcher()[1]
+    # Search terms such as "snake charmed" are written that way on purpose
+    alternatives = {term.lower() for term in index_terms()} - {role.lower() for role in role_types}
+    line_number = 0
+    for block, is_last in read_blocks(file_path, problems):
+        in_answer = False
+        deprecated = False
+        list_marker = None      # the marker of the list the previous line was in, if any
+        for line in block:
+            line_number += 1
+            text = line.rstrip('\n')
+            stripped = text.strip()
+            if not stripped:
+                list_marker = None
+                continue
+            found = []
+            if not text.isascii():
+                for match in LINT_INVISIBLE.finditer(text):
+                    found.append(f"invisible character U+{ord(match.group(0)):04X} in column {match.start() + 1}")
+
+            first = text[:1]
+            marker = stripped[0] if stripped[0] in '#*' else None
+            prose = first.isspace() or marker is not None     # list lines are read wherever they start
+            if first in 'QADC' and text[1:2] == ' ':
+                prose = first != 'C'
+                if first == 'Q' and not stripped[1:]:
+                    found.append("the question is empty")
+                elif first == 'A':
+                    in_answer = True
+                elif first == 'D':
+                    if not in_answer:
+                        found.append("'D' before the answer it belongs to")
+                    elif deprecated:
+                        found.append("a second 'D' in the same answer")
+                    deprecated = True
+                elif first == 'C' and not block[0].startswith('Q '):
+                    found.append("citation before the first question")
+            elif first == '=':
+                section = stripped.strip('=')
+                if section and not text.startswith('==') and section not in role_types:
+                    found.append(f"section banner for '{section}', which is not a role")
+            elif text.startswith(('--', ':')):
+                pass
+            elif first in 'QADC':
+                found.append(f"starts with '{first}' but not '{first} ', indent it if it carries on the line before")
+            elif not prose:
+                found.append("not indented, so it is taken as part of the line before")
+
+            if marker:
+                if not in_answer:
+                    found.append(f"'{marker}' list line outside an answer")
+                if not stripped[1:].strip():
+                    found.append(f"'{marker}' list line without any text")
+                if list_marker and marker != list_marker:
+                    found.append(f"'{marker}' list line straight after a '{list_marker}' list, which it ends up inside")
+            list_marker = marker
+
+            if prose:
+                if '_' in text:
+                    found.extend(lint_emphasis(text))
+                found.extend(lint_roles(text, alternatives))
+            if found:
+                problems.extend((line_number, problem) for problem in found)
+    problems.sort(key=lambda problem: problem[0])
+    return problems
+
+
+def run_lint(file_path: str) -> bool:
+    start = time.perf_counter()
+    problems = lint(file_path)
+    milliseconds = (time.perf_counter() - start) * 1000
+
+    file_name = os.path.basename(file_path)
+    for line_number, problem in problems:
+        print(f"{file_name}:{line_number}: {problem}")
+    print(f"  {len(problems)} problems found in {file_name}, in {milliseconds:.0f} ms")
+    return not problems
 
 
 def manage_backups(filename: str) -> None:
-    backup_files = [f for f in os.listdir() if f.startswith(f"Back up of {filename.split('.')[0]}")]
-
-    if len(backup_files) >= MAX_BACKUPS:
-        backup_files.sort(key=lambda x: os.path.getctime(x))
-        oldest_backup = backup_files[0]
-        os.remove(oldest_backup)
-        print(f"  Deleted the oldest backup file: {oldest_backup}")
-
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    backup_filename = f"Back up of {filename.split('.')[0]}-{timestamp}.html"
+    store = BackupStore(BACKUP_DIR)
+    backup, stored = store.add(filename)
+    if backup is None:
+        print(f"  {filename} is unchanged since the backup of {store.backups[-1]['timestamp']}")
+        return
 
-    shutil.copy(filename, backup_filename)
-    print(f"  Created backup: {backup_filename}")
+    how = "whole" if store.objects[backup["hash"]]["base"] is None else "as a delta"
+    if stored == 0:
+        how = "as a version already in the store"
+    print(f"  Backed up {filename} as {backup['timestamp']}, {how}: {stored:,} bytes for {backup['size']:,}")
+    print("  Backup store: " + space_saved(store))
 
 
-def surround_keywords_with_span(html_content:str, keywords: 'list[str]', character_type: str) -> str:
-    soup = BeautifulSoup(html_content, 'html.parser')
+def list_backups() -> None:
+    store = BackupStore(BACKUP_DIR)
+    if not store.backups:
+        print("No backups in " + BACKUP_DIR)
+        return
 
-    def replace_match(match):
-        word = match.group(0)
-        if word.endswith('s') and word[:-1] in keywords:
-            return f'<span class="{character_type}">{word[:-1]}</span>s'
-        return f'<span class="{character_type}">{word}</span>'
+    timestamps = {}
+    for backup in store.backups:
+        timestamps.setdefault(backup["hash"], backup["timestamp"])
+    print(f"  {'Timestamp':<18}{'Bytes':>12}  Stored")
+    for backup in store.backups:
+        stored = store.objects[backup["hash"]]
+        base = stored["base"]
+        how = "whole" if base is None else "delta against " + timestamps.get(base, base[:12])
+        if timestamps[backup["hash"]] != backup["timestamp"]:
+            how = "same as " + timestamps[backup["hash"]]
+        print(f"  {backup['timestamp']:<18}{backup['size']:>12,}  {how}")
+    print("  " + space_saved(store))
+
+
+def restore_backup(timestamp: str, filename: str) -> bool:
+    store = BackupStore(BACKUP_DIR)
+    backup = store.find(timestamp)
+    if backup is None:
+        print(f"  No backup from {timestamp}, see --list-backups")
+        return False
 
-    for keyword in keywords:
-        print("  Highlighting: " + keyword + "                               ", end='\r')
+    # What is there now is backed up first, so the restore can itself be undone. That can prune
+    # the oldest backup, which may be the one being restored, so it is read before anything else.
+    text = store.read(backup["hash"])
+    if os.path.exists(filename):
+        manage_backups(filename)
+    size = write_atomically(filename, [text.encode('utf-8')], 'wb')
+    print(f"  Restored {filename} from the backup of {timestamp}: {size:,} bytes")
+    return True
 
-        matches = soup.find_all(string=re.compile(r'\b' + re.escape(keyword) + 's?' + r'\b'))
-        for match in matches:
-            content = str(match)
-            replaced_content = re.sub(r'\b' + re.escape(keyword) + r's?' + r'\b', replace_match, content)
-            match.replace_with(BeautifulSoup(replaced_content, 'html.parser'))
 
-    return str(soup)
+def trie_alternation(names: 'Iterable[str]') -> str:
+    # The names as one regex that shares their common prefixes, so at each character there is only one branch to try.
+    # Longer names still win over shorter ones they start with, e.g. "Poisoner" over "Po", as the regex is greedy.
+    trie = {}
+    for name in names:
+        branch = trie
+        for character in name:
+            branch = branch.setdefault(character, {})
+        branch[''] = {}
+
+    def alternation(branch: dict) -> str:
+        children = [re.escape(character) + alternation(child) for character, child in sorted(branch.items()) if character]
+        if not children:
+            return ''
+        if len(children) == 1 and '' not in branch:
+            return children[0]
+        return '(?:' + '|'.join(children) + ')' + ('?' if '' in branch else '')
+    return alternation(trie)
+
+
+def compile_role_matcher(roles_by_type: 'dict[str, list[str]]', plural: str) -> 'tuple[str, dict[str, str]]':
+    # The regex finding any role name, plural or not, and the type of each role; a name under two types keeps the first
+    role_types = {}
+    for character_type, keywords in roles_by_type.items():
+        for keyword in keywords:
+            role_types.setdefault(keyword, character_type)
+    return r'\b(?:' + trie_alternation(role_types) + f')(?:{re.escape(plural)})?\\b', role_types
+
+
+def surround_roles_with_span(element: 'Element', pattern: 're.Pattern', role_types: 'dict[str, str]', roles: 'set[tuple[str, str]]',
+                             plural: str = "s") -> int:
+    highlighted = 0
+    children = []
+
+    for child in element.children:
+        if not isinstance(child, str):
+            highlighted += surround_roles_with_span(child, pattern, role_types, roles, plural)
+            children.append(child)
+            continue
+
+        position = 0
+        for match in pattern.finditer(child):
+            word = match.group(0)
+            suffix = ""
+            if word.endswith(plural) and word[:-len(plural)] in role_types:
+                word, suffix = word[:-len(plural)], plural
+
+            span = Element('span', role_types[word])
+            span.children.append(word)
+            roles.add((role_types[word], word))
+            children.extend(piece for piece in (child[position:match.start()], span, suffix) if piece)
+            position = match.end()
+            highlighted += 1
+        if child[position:]:
+            children.append(child[position:])
+
+    element.children = children
+    return highlighted
 
 
 def temporarily_escape_unsafe_characters(input_string:str) -> str:
@@ -137,67 +716,461 @@ def use_html_entities(input_string:str) -> str:
     return escaped_string
 
 
-def text_to_nodes(input_path: str, output_path: str) -> str:
-    output_lines = []
+class Element:
+    """A bare-bones HTML element. Children are plain strings or other elements."""
+    __slots__ = ('tag', 'css_class', 'children')
+
+    def __init__(self, tag: str, css_class: str = None):
+        self.tag = tag
+        self.css_class = css_class
+        self.children = []
+
+    def text(self) -> str:
+        return ''.join(child if isinstance(child, str) else child.text() for child in self.children)
+
+    def find_all(self, tag: str) -> 'list[Element]':
+        found = []
+        for child in self.children:
+            if isinstance(child, Element):
+                if child.tag == tag:
+                    found.append(child)
+                found.extend(child.find_all(tag))
+        return found
+
+    def start_tag(self) -> str:
+        if self.css_class:
+            return f'<{self.tag} class="{self.css_class}">'
+        return f'<{self.tag}>'
+
+    def render(self, out: 'list[str]') -> None:
+        out.append(self.start_tag())
+        for child in self.children:
+            if isinstance(child, str):
+                out.append(child)
+            else:
+                child.render(out)
+        out.append(f'</{self.tag}>')
+
+
+class TreeBuilder:
+    """
+    Builds Elements from the tags text_to_nodes emits, the same way BeautifulSoup's
+    html.parser builder would: end tags pop back to the most recent matching open
+    tag (or are ignored) and whitespace-only strings collapse to a newline or space.
+    Only our own tags are ever fed in; the text itself has its angle brackets escaped.
+    """
+    TAG = re.compile(r'<(/?)(\w+)(?: class="([^"]*)")?>')
+    ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
+
+    def __init__(self):
+        self.root = Element('[document]')
+        self.stack = [self.root]
+        self.pending = []
+        self.started = False
+        self.muted = False     # set while skipping over a block that comes from the build cache
+
+    def append(self, item: str) -> Element:
+        # Returns the first element the item opens, if any.
+        # Items are separated by a newline, as if they were joined into one string
+        if self.muted:
+            return None
+        if self.started:
+            self.pending.append('\n')
+        self.started = True
+
+        opened = None
+        position = 0
+        for match in self.TAG.finditer(item):
+            self.pending.append(item[position:match.start()])
+            closing, tag, css_class = match.groups()
+            if closing:
+                self.end(tag)
+            elif opened is None:
+                opened = self.start(tag, css_class)
+            else:
+                self.start(tag, css_class)
+            position = match.end()
+        self.pending.append(item[position:])
+        return opened
+
+    def flush(self) -> None:
+        data = ''.join(self.pending)
+        self.pending = []
+        if not data:
+            return
+        if not data.strip(self.ASCII_SPACES):
+            data = '\n' if '\n' in data else ' '
+        self.stack[-1].children.append(data)
+
+    def start(self, tag: str, css_class: str = None) -> Element:
+        self.flush()
+        element = Element(tag, css_class)
+        self.stack[-1].children.append(element)
+        self.stack.append(element)
+        return element
+
+    def end(self, tag: str) -> None:
+        self.flush()
+        for index in range(len(self.stack) - 1, 0, -1):
+            if self.stack[index].tag == tag:
+                del self.stack[index:]
+                return
+
+    def close(self) -> Element:
+        self.flush()
+        del self.stack[1:]
+        return self.root
+
+
+class Node:
+    """
+    One question and its answer, as parsed from BotC.txt.
+    Once a node is finished its tree goes and its html moves to a spool, leaving only what later stages need.
+    """
+    __slots__ = ('id', 'section', 'element', 'question', 'answer', 'deprecated', 'citations', 'roles', 'key', 'html',
+                 'terms', 'spool', 'offset', 'length')
+
+    def __init__(self, id: int, section: str):
+        self.id = id
+        self.section = section
+        self.element = None         # the <div class="node">
+        self.question = None        # the <h4 class="question">
+        self.answer = None          # the <div class="answer">
+        self.deprecated = None      # the <div class="deprecated">, if any
+        self.citations = []         # the 'C ' lines
+        self.roles = set()          # (character type, role) pairs mentioned, filled in by finish_nodes
+        self.key = None             # build cache key
+        self.html = None            # rendered node, when it came from the build cache or has been rendered already
+        self.terms = 0              # bit i is set if the i-th of index_single_terms() is in the node
+        self.spool = None           # where the rendered node is kept once it is finished
+        self.offset = 0
+        self.length = 0
+
+    @property
+    def paragraphs(self) -> 'list[Element]':
+        return self.answer.find_all('p') if self.answer else []
+
+    @property
+    def lists(self) -> 'list[Element]':
+        if not self.answer:
+            return []
+        return self.answer.find_all('ul') + self.answer.find_all('ol')
+
+    def fragment(self) -> str:
+        # The rendered node, wherever it is kept
+        if self.html is not None:
+            return self.html
+        return self.spool.read(self.offset, self.length)
+
+    def render(self, out: 'list[str]') -> None:
+        if self.element is not None:
+            self.element.render(out)
+        else:
+            out.append(self.fragment())
+
+
+def remove_empty_divs(element: Element) -> None:
+    kept = []
+    for child in element.children:
+        if isinstance(child, Element) and child.tag == 'div' and not child.text().strip():
+            continue
+        if isinstance(child, Element):
+            remove_empty_divs(child)
+        kept.append(child)
+    element.children = kept
+
+
+def trim_node(node: Node) -> bool:
+    # Drop divs left without any text. Returns False if the node itself went with them.
+    if node.html is not None:
+        return True
+    document = Element('[document]')
+    document.children = [node.element]
+    remove_empty_divs(document)
+    remaining = set(document.find_all('div'))
+    if node.element not in remaining:
+        return False
+    if node.answer not in remaining:
+        node.answer = None
+    if node.deprecated not in remaining:
+        node.deprecated = None
+    return True
 
-    answer_mode = False
-    in_list = False
-    in_ordered_list = False
-    deprecation_mode = False
-    first_question = True
-    id = 0
-    with open(input_path, 'r', encoding="utf-8") as file:
-        for line in file:
-            line = temporarily_escape_unsafe_characters(line)
+
+class Spool:
+    """Rendered nodes, kept in a temporary file until the pages are written."""
+    def __init__(self):
+        self.file = tempfile.TemporaryFile()
+        self.size = 0
+        self.lock = threading.Lock()   # the character pages are written from several threads
+
+    def write(self, text: str) -> 'tuple[int, int]':
+        # Returns where the text went, for read
+        data = text.encode('utf-8')
+        with self.lock:
+            if self.file.tell() != self.size:
+                self.file.seek(self.size)
+            self.file.write(data)
+            offset = self.size
+            self.size += len(data)
+        return offset, len(data)
+
+    def read(self, offset: int, length: int) -> str:
+        with self.lock:
+            self.file.seek(offset)
+            return self.file.read(length).decode('utf-8')
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class BuildCache:
+    """
+    Rendered and highlighted nodes from the previous build, keyed on a hash of the
+    block's source text, the parser state going into it and the keyword lists.
+    The file has a line per node after a header, and only where each line starts is kept in memory.
+    Each build writes the nodes it ends up with to a new file, so removed or changed blocks drop out.
+    """
+    def __init__(self, path: str, keywords_hash: str):
+        self.path = path
+        self.keywords_hash = keywords_hash
+        self.offsets = None     # read when the first build starts
+        self.hits = 0
+        self.misses = 0
+        self.reader = None
+        self.writer = None
+
+        # A different version of this script may render blocks differently
+        self.version = script_hash()
+        self.header = (json.dumps({"version": self.version}) + "\n").encode('utf-8')
+
+    def __getstate__(self) -> dict:
+        # Section workers get their own copy, which opens the file again if it needs to
+        state = self.__dict__.copy()
+        state["reader"] = state["writer"] = None
+        return state
+
+    def read_offsets(self) -> 'dict[bytes, int]':
+        offsets = {}
+        if not os.path.exists(self.path):
+            return offsets
+        with open(self.path, 'rb') as file:
+            if file.readline() != self.header:
+                return offsets
+            position = file.tell()
+            for line in file:
+                offsets[bytes.fromhex(line[:64].decode('ascii'))] = position
+                position += len(line)
+        return offsets
+
+    def key(self, block: str, *state) -> bytes:
+        hasher = hashlib.sha256(self.keywords_hash.encode())
+        hasher.update(repr(state).encode())
+        hasher.update(block.encode())
+        return hasher.digest()
+
+    def lookup(self, node: 'Node') -> bool:
+        offset = self.offsets.get(node.key)
+        if offset is None:
+            self.misses += 1
+            return False
+        if self.reader is None:
+            self.reader = open(self.path, 'rb')
+        self.reader.seek(offset)
+        html, roles = json.loads(self.reader.readline()[65:])
+        self.hits += 1
+        node.html = html
+        node.roles = set(tuple(role) for role in roles)
+        return True
+
+    def start(self) -> None:
+        self.hits = self.misses = 0
+        if self.offsets is None:
+            self.offsets = self.read_offsets()
+        if self.writer is not None:     # left over from a build that failed
+            self.writer.close()
+        self.writer = open(self.path + ".tmp", 'wb')
+        self.writer.write(self.header)
+
+    def record(self, node: 'Node') -> None:
+        entry = json.dumps([node.html, sorted(node.roles)])
+        self.writer.write(node.key.hex().encode('ascii') + b' ' + entry.encode('utf-8') + b'\n')
+
+    def save(self) -> None:
+        self.writer.close()
+        self.writer = None
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+        os.replace(self.path + ".tmp", self.path)
+        self.offsets = None     # only read again if there is another build
+
+    def abandon(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+        if os.path.exists(self.path + ".tmp"):
+            os.remove(self.path + ".tmp")
+
+
+@functools.lru_cache(maxsize=None)
+def script_hash() -> str:
+    with open(__file__, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+def compile_keywords(data: dict, keywords_hash: str) -> dict:
+    """
+    Everything the build needs from BotC keywords.json, which lists the keyword menu by heading.
+    A keyword is a role name, or any other word, followed by any | alternatives the menu searches for along with it.
+    The headings under "role types" are character types, and only the first word of their keywords is a role name;
+    roles are also found with the "plural" ending.
+    """
+    menu = data["keywords"]
+    roles_by_type = {character_type: [keyword.split('|')[0].strip() for keyword in menu[character_type]]
+                     for character_type in data["role types"]}
+    pattern, role_types = compile_role_matcher(roles_by_type, data["plural"])
+
+    # Each keyword from the menu, and each of its | alternatives, as updateFiltering splits them
+    terms = []
+    for keywords in menu.values():
+        for keyword in keywords:
+            for term in [keyword] + [alternative.strip() for alternative in keyword.split('|')]:
+                if term not in terms:
+                    terms.append(term)
+    return {"version": script_hash(), "hash": keywords_hash, "menu": menu, "plural": data["plural"],
+            "pattern": pattern, "role types": role_types, "terms": terms}
+
+
+def load_keywords(path: str, cache_path: str) -> dict:
+    # The compiled keywords, from the cache unless the keywords file or this script has changed since
+    with open(path, 'rb') as file:
+        source = file.read()
+    source_hash = hashlib.sha256(source).hexdigest()
+    try:
+        with open(cache_path, 'rb') as file:
+            registry = pickle.load(file)
+        if registry["version"] == script_hash() and registry["hash"] == source_hash:
+            return registry
+    except (OSError, pickle.UnpicklingError, EOFError, KeyError, TypeError):
+        pass    # no cache yet, or one that cannot be read, so it is made again
+
+    registry = compile_keywords(json.loads(source), source_hash)
+    try:
+        write_atomically(cache_path, [pickle.dumps(registry, pickle.HIGHEST_PROTOCOL)], 'wb')
+    except OSError:
+        pass    # it is only a cache
+    return registry
+
+
+@functools.lru_cache(maxsize=None)
+def keyword_registry() -> dict:
+    return load_keywords(KEYWORDS_FILE, KEYWORDS_CACHE_FILE)
+
+
+def keywords_hash() -> str:
+    return keyword_registry()["hash"]
+
+
+def section_name(banner: str) -> str:
+    # The drawn banner over the questions about no one character has its lines start with ==
+    return "" if banner.startswith('==') else banner.strip().strip('=')
+
+
+class NodeParser:
+    """
+    The line-by-line state machine that turns blocks of BotC.txt into nodes.
+    Blocks are fed in order; the parser can also start part way through the file,
+    which is how sections get built in parallel.
+    """
+    def __init__(self, cache: BuildCache = None, id: int = 0, section: str = ""):
+        self.builder = TreeBuilder()
+        self.cache = cache
+        self.nodes = []
+        self.node = Node(id, section)    # stands in for anything before the first question
+
+        self.answer_mode = False
+        self.in_list = False
+        self.in_ordered_list = False
+        self.deprecation_mode = False
+        self.first_question = True
+        self.section = section
+        self.id = id
+
+    def close_node(self) -> None:
+        builder = self.builder
+        builder.append('        </p>\n')   # close paragraph
+        builder.append('      </div>\n')   # close answer
+        if self.deprecation_mode:
+            self.deprecation_mode = False
+            builder.append('    </div>\n')     # close deprecation
+
+        builder.append('    </div>\n')     # close node
+
+    def feed(self, block: 'list[str]', is_last: bool) -> None:
+        builder = self.builder
+        node = self.node
+
+        for raw_line in block:
+            line = temporarily_escape_unsafe_characters(raw_line)
             # blank lines separate question-answer blocks, but also indicate the end of lists and paragraphs within answers so need to handle this
             if line.strip() == '':
-                if in_list:
-                    output_lines.append(  '</ul>' )
-                    in_list = False
-                elif in_ordered_list:
-                    output_lines.append(  '</ol>' )
-                    in_ordered_list = False
+                if self.in_list:
+                    builder.append(  '</ul>' )
+                    self.in_list = False
+                elif self.in_ordered_list:
+                    builder.append(  '</ol>' )
+                    self.in_ordered_list = False
 
-                if answer_mode:
-                    output_lines.append('        </p>\n')   # close paragraph
-                    output_lines.append('        <p>')      # open paragraph
+                if self.answer_mode:
+                    builder.append('        </p>\n')   # close paragraph
+                    builder.append('        <p>')      # open paragraph
 
             # question time
             elif line.startswith('Q '):
-                answer_mode = False
-                id += 1
+                self.answer_mode = False
+                self.id += 1
 
-                if first_question:
-                    first_question = False
+                if self.first_question:
+                    self.first_question = False
                 else:
-                    output_lines.append('        </p>\n')   # close paragraph
-                    output_lines.append('      </div>\n')   # close answer
-                    if deprecation_mode:
-                        deprecation_mode = False
-                        output_lines.append('    </div>\n')     # close deprecation
+                    self.close_node()
 
-                    output_lines.append('    </div>\n')     # close node
+                # Blocks that are unchanged since the last build are not built again
+                node = self.node = Node(self.id, self.section)
+                if self.cache is not None:
+                    node.key = self.cache.key(''.join(block), self.in_list, self.in_ordered_list, is_last)
+                    builder.muted = self.cache.lookup(node)
 
-                output_lines.append('    <div class="node">\n')  # open node
-                output_lines.append('      <h4 class="question">' + line[2:])   # open question
+                node.element = builder.append('    <div class="node">\n')  # open node
+                node.question = builder.append('      <h4 class="question">' + line[2:])   # open question
+                self.nodes.append(node)
 
             elif line.startswith('A '):
-                answer_mode = True
-                output_lines.append('      </h4>\n')        # close question
+                self.answer_mode = True
+                builder.append('      </h4>\n')        # close question
                 if line[2:].strip() == '':
-                    output_lines.append('      <div class="answer">\n          <p>')                # fix for when answer starts on next line
+                    node.answer = builder.append('      <div class="answer">\n          <p>')                # fix for when answer starts on next line
                 else:
-                    output_lines.append('      <div class="answer">\n          <p>' + line[2:])     # open answer and open first paragraph
+                    node.answer = builder.append('      <div class="answer">\n          <p>' + line[2:])     # open answer and open first paragraph
 
             # deprecated info
             elif line.startswith('D '):
-                deprecation_mode = True
-                output_lines.append('          </p>\n')      # close paragraph
-                output_lines.append('          <div class="deprecated">            <p>' + line[2:])      # open paragraph
+                self.deprecation_mode = True
+                builder.append('          </p>\n')      # close paragraph
+                node.deprecated = builder.append('          <div class="deprecated">            <p>' + line[2:])      # open paragraph
 
             # citations
             elif line.startswith('C '):
-                pass
+                if not self.first_question:
+                    self.node.citations.append(raw_line[2:].strip())
+
+            # section banners, e.g. =Acrobat=, or a line of a drawn one, which gives no name
+            elif line.startswith('=') and line.strip().strip('='):
+                self.section = section_name(line)
 
             # skip comments
             elif line.startswith('=') or line.startswith('--') or line.startswith(':'):
@@ -205,337 +1178,1599 @@ def text_to_nodes(input_path: str, output_path: str) -> str:
 
             # ordered_list
             elif line.strip().startswith('#'):
-                if not in_ordered_list:
-                    output_lines.append('<ol><li>')
-                    in_ordered_list = True
+                if not self.in_ordered_list:
+                    builder.append('<ol><li>')
+                    self.in_ordered_list = True
                 else:
-                    output_lines.append("</li><li>")
+                    builder.append("</li><li>")
 
-                output_lines.append(line.replace("#","",1))
+                builder.append(line.replace("#","",1))
             
             # unordered list
             elif line.strip().startswith('*'):
-                if not in_list:
-                    output_lines.append('<ul><li>')
-                    in_list = True
+                if not self.in_list:
+                    builder.append('<ul><li>')
+                    self.in_list = True
                 else:
-                    output_lines.append("</li><li>")
+                    builder.append("</li><li>")
 
-                output_lines.append(line.replace("*","",1))
+                builder.append(line.replace("*","",1))
 
             else:
-                output_lines.append(line)
+                builder.append(line)
+
+    def take_complete(self) -> 'list[Node]':
+        """
+        The nodes that nothing more can be added to, in order, leaving out any without text.
+        The document lets go of their trees, so the parser holds little more than the node it is in.
+        """
+        stack = self.builder.stack
+        count = 0
+        for node in self.nodes:
+            if node is self.node or node.element in stack:
+                break
+            count += 1
+        complete = self.nodes[:count]
+        del self.nodes[:count]
+
+        root = self.builder.root
+        root.children = [child for child in root.children if child in stack]
+        return [node for node in complete if trim_node(node)]
+
+    def finish(self) -> 'list[Node]':
+        # The rest of the nodes, now that nothing is left open
+        self.builder.close()
+        self.node = None
+        return self.take_complete()
+
+
+def finish_nodes(nodes: 'list[Node]') -> int:
+    # Highlights and renders the nodes that did not come from the build cache, then lets go of their trees.
+    # Returns the number of mentions highlighted.
+    pattern, role_types = role_matcher()
+    plural = keyword_registry()["plural"]
+    highlighted = 0
+    for node in nodes:
+        if node.html is None:
+            highlighted += surround_roles_with_span(node.element, pattern, role_types, node.roles, plural)
+            node.html = render_node(node)
+        node.element = node.question = node.answer = node.deprecated = None
+    return highlighted
+
+
+class NodeStore:
+    """
+    Takes nodes as the parser finishes them. Each batch is highlighted, rendered and searched for the
+    index terms, then recorded in the build cache and moved out to a spool, so only a few hundred
+    rendered nodes and a little about every other node are held in memory at once.
+    """
+    def __init__(self, cache: BuildCache = None, found_terms: 'dict[tuple[str, str], int]' = None,
+                 database: 'NodeDatabase' = None):
+        self.cache = cache
+        self.database = database
+        self.found_terms = found_terms  # index terms in each question and answer seen by earlier builds
+        self.seen_parts = set() if found_terms is not None else None
+        self.spool = Spool()
+        self.nodes = []
+        self.batch = []
+        self.highlighted = 0
+        self.shared = {}    # equal role pairs and sets of roles share one tuple
+
+    def add(self, nodes: 'list[Node]') -> None:
+        self.highlighted += finish_nodes(nodes)
+        self.batch.extend(nodes)
+        if len(self.batch) >= SPOOL_BATCH:
+            self.flush()
+
+    def flush(self) -> None:
+        batch = self.batch
+        self.batch = []
+        parts = [split_rendered_node(node.html) for node in batch]
+
+        # Questions and answers that were searched in an earlier build are not searched again
+        found_terms = self.found_terms if self.found_terms is not None else {}
+        new_parts = [part for part in dict.fromkeys(parts) if part not in found_terms]
+        if new_parts:
+            found = [0] * len(new_parts)
+            for bit, positions in enumerate(find_keyword_nodes(new_parts, index_single_terms()).values()):
+                for position in positions:
+                    found[position] |= 1 << bit
+            found_terms.update(zip(new_parts, found))
+
+        if self.database is not None:
+            self.database.add(batch, parts)
+        for node, part in zip(batch, parts):
+            node.terms = found_terms[part]
+            if self.seen_parts is not None:
+                self.seen_parts.add(part)
+            if self.cache is not None:
+                self.cache.record(node)
+            node.offset, node.length = self.spool.write(node.html)
+            node.spool = self.spool
+            roles = tuple(sorted(self.shared.setdefault(pair, pair) for pair in node.roles))
+            node.roles = self.shared.setdefault(roles, roles)
+            node.html = node.key = node.citations = None
+        self.nodes.extend(batch)
+
+    def finish(self) -> 'list[Node]':
+        self.flush()
+        if self.seen_parts is not None:
+            for part in [part for part in self.found_terms if part not in self.seen_parts]:
+                del self.found_terms[part]
+            self.seen_parts = set()
+        return self.nodes
+
+    def close(self) -> None:
+        self.spool.close()
+
+
+def text_to_nodes(blocks: 'Iterable[tuple[list[str], bool]]', output_path: str, store: NodeStore) -> 'list[Node]':
+    # Nodes go to the store as soon as they are finished, so the whole document is never held in memory
+    parser = NodeParser(store.cache)
+    for block, is_last in blocks:
+        parser.feed(block, is_last)
+        store.add(parser.take_complete())
+    store.add(parser.finish())
+    nodes = store.finish()
+
+    print("  Processed " + str(parser.id) + " nodes")
+    if store.cache is not None:
+        print(f"  Build cache: {store.cache.hits} hits, {store.cache.misses} misses")
+    print(f"  Highlighted {store.highlighted} mentions of {len(role_matcher()[1])} roles")
+    debug(lambda: render_nodes(nodes), output_path)
+    return nodes
+
+
+def split_sections(blocks: 'list[tuple[list[str], bool]]') -> 'list[tuple[list[tuple[list[str], bool]], int, str]]':
+    # A section starts with the first question after a =Name= banner.
+    # Returns each section's blocks along with the node id and section name it starts from.
+    sections = []
+    current = []
+    id = 0
+    section = ""
+    start_id, start_section = id, section
+    for block, is_last in blocks:
+        current.append((block, is_last))
+        if block and block[0].startswith('Q '):
+            id += 1
+
+        banners = [section_name(line) for line in block if line.startswith('=') and line.strip().strip('=')]
+        if banners and not is_last:
+            sections.append((current, start_id, start_section))
+            current = []
+            start_id, start_section = id, banners[-1]
+    if current:
+        sections.append((current, start_id, start_section))
+    return sections
+
+
+_worker_cache = None
+
+
+def init_section_worker(cache: BuildCache) -> None:
+    global _worker_cache
+    _worker_cache = cache
+
+
+def render_section(section: 'tuple[list[tuple[list[str], bool]], int, str]') -> 'tuple[list[Node], bool, int, int, int]':
+    blocks, id, name = section
+    cache = _worker_cache
+    hits, misses = (cache.hits, cache.misses) if cache is not None else (0, 0)
+
+    parser = NodeParser(cache, id, name)
+    nodes = []
+    for block, is_last in blocks:
+        parser.feed(block, is_last)
+        nodes.extend(parser.take_complete())
+    # Close the last node here, as the question that follows in the next section would have
+    if not blocks[-1][1] and not parser.first_question:
+        parser.close_node()
+
+    # Every section is parsed as if nothing was left open before it, check that held for the next one
+    clean = not parser.in_list and not parser.in_ordered_list and len(parser.builder.stack) == 1
+
+    # Only the rendered html goes back to the main process, sending the trees costs more than building them
+    nodes.extend(parser.finish())
+    highlighted = finish_nodes(nodes)
+
+    if cache is not None:
+        hits, misses = cache.hits - hits, cache.misses - misses
+    return nodes, clean, highlighted, hits, misses
+
+
+def render_in_parallel(blocks: 'list[tuple[list[str], bool]]', store: NodeStore, jobs: int) -> 'list[Node] | None':
+    # Returns None if the sections cannot be built apart, in which case the store has to be thrown away
+    sections = split_sections(blocks)
+    cache = store.cache
+    print(f"  Rendering {len(sections)} sections with {jobs} processes")
+
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_section_worker, initargs=(cache,)) as executor:
+        results = executor.map(render_section, sections, chunksize=max(1, len(sections) // (jobs * 4)))
+
+        # Results come back in section order, so the nodes are in the same order as a serial build
+        for index, (section_nodes, clean, highlighted, hits, misses) in enumerate(results):
+            if not clean and index < len(sections) - 1:
+                print("  A section leaves a list or tag open, building serially instead")
+                return None
+            store.add(section_nodes)
+            store.highlighted += highlighted
+            if cache is not None:
+                cache.hits += hits
+                cache.misses += misses
+    nodes = store.finish()
+
+    print("  Processed " + str(len(nodes)) + " nodes")
+    if cache is not None:
+        print(f"  Build cache: {cache.hits} hits, {cache.misses} misses")
+    print(f"  Highlighted {store.highlighted} mentions of {len(role_matcher()[1])} roles")
+    return nodes
+
+
+EMPHASIS = re.compile(r'_(\S(?:.*?\S)?)_')   # the text between a pair of underscores
+
+
+def drop_blank_lines(text: str) -> str:
+    # Blank lines that lie wholly inside the text. Its first and last lines share a line with a tag.
+    lines = text.split('\n')
+    if len(lines) < 3:
+        return text
+    return '\n'.join([lines[0]] + [line for line in lines[1:-1] if line.strip()] + [lines[-1]])
+
+
+class LineWriter:
+    """
+    Collects a rendered node a line at a time and tidies each line up as soon as it is complete:
+    entities go back in, _emphasis_ becomes <em></em> and lines holding an empty paragraph are dropped.
+    """
+    def __init__(self):
+        self.chunks = []
+        self.line = []          # the pieces of the line being written
+        self.started = False
+
+    def write(self, text: str) -> None:
+        parts = text.split('\n')
+        self.line.append(parts[0])
+        for part in parts[1:]:
+            self.end_line()
+            self.line = [part]
+
+    def end_line(self) -> None:
+        line = self.tidy(''.join(self.line))
+        self.line = []
+        if line is None:
+            return
+        if self.started:
+            self.chunks.append('\n')
+        self.started = True
+        self.chunks.append(line)
+
+    def tidy(self, line: str) -> 'str | None':
+        if "</span><span" in line:
+            line = line.replace("</span><span", "</span> <span")
+        if "_SYMBOL" in line:
+            line = use_html_entities(line)
+        if '_' in line:
+            line = EMPHASIS.sub(r'<em>\1</em>', line)
+        if line.strip().startswith("<p></p>"):
+            return None
+        return line
+
+    def close(self) -> 'list[str]':
+        self.end_line()
+        return self.chunks
+
+
+class PrettyPrinter:
+    """
+    Indents nodes as they are written, by the rules of yattag's indent, which the guide used to go through.
+    Every tag goes on its own line, two spaces deeper than its parent, except inside elements that hold
+    text, which are written out as they are. Text that is only whitespace is dropped, as are blank lines.
+    """
+    def __init__(self, write: 'Callable[[str], None]', level: int = 0, tag_appeared: bool = False):
+        self.write = write
+        self.level = level
+        self.sameline = 0            # how deep inside an element holding text we are
+        self.was_just_opened = False
+        self.tag_appeared = tag_appeared
+
+    def new_line(self) -> None:
+        self.write(('\n' if self.tag_appeared else '') + '  ' * self.level)
+
+    def text(self, content: str) -> None:
+        if not content.strip():
+            return
+        content = drop_blank_lines(content)
+        if not self.sameline:
+            self.new_line()
+        self.write(content)
+        self.was_just_opened = False
+
+    def start(self, tag: str, holds_text: bool) -> None:
+        self.was_just_opened = True
+        if self.sameline:
+            self.sameline += 1
+        else:
+            self.new_line()
+        if holds_text:
+            self.sameline = self.sameline or 1
+        self.write(tag)
+        self.level += 1
+        self.tag_appeared = True
+
+    def end(self, tag: str) -> None:
+        self.level -= 1
+        self.tag_appeared = True
+        if self.sameline:
+            self.sameline -= 1
+        elif not self.was_just_opened:
+            self.new_line()
+        self.write(tag)
+        self.was_just_opened = False
+
+
+def print_element(printer: PrettyPrinter, element: Element) -> None:
+    printer.start(element.start_tag(), any(isinstance(child, str) and child.strip() for child in element.children))
+    text = []
+    for child in element.children:
+        if isinstance(child, str):
+            text.append(child)
+            continue
+        if text:
+            printer.text(''.join(text))
+            text = []
+        print_element(printer, child)
+    if text:
+        printer.text(''.join(text))
+    printer.end(f'</{element.tag}>')
+
+
+def render_node(node: 'Node') -> str:
+    # The node's finished lines, as they will appear on the page
+    writer = LineWriter()
+    print_element(PrettyPrinter(writer.write, NODE_INDENT_LEVEL, tag_appeared=True), node.element)
+    return ''.join(writer.close())
+
+
+def render_nodes(nodes: 'list[Node]') -> str:
+    out = []
+    for node in nodes:
+        node.render(out)
+    return ''.join(out)
 
-    print("  Processed " + str(id) + " nodes")
-    debug(output_lines, output_path)
-    return '\n'.join(output_lines)
 
+def load_template(path: str) -> 'list[str]':
+    # The page shell split at its markers, so filling it in is a matter of joining the pieces
+    print("  Opening " + path)
+    with open(path, 'r', encoding="utf-8") as file:
+        return TEMPLATE_MARKER.split(file.read())
 
-def replace_nodes(original: str, replacement: str, output_path: str) -> str:
-    print("  Opening current version of guide")
-    with open(original, 'r', encoding="utf-8") as file:
-        html_content = file.read()
-        soup = BeautifulSoup(html_content, 'html.parser')
-        main_tag = soup.find('main')
 
-    # Parse the replacement content and remove empty paragraphs
-    print("  Removing empty divs")
-    replacement_soup = BeautifulSoup(replacement, 'html.parser')
-    for p_tag in replacement_soup.find_all('div'):
-        if not p_tag.text.strip():  # Check if the paragraph has only whitespace
-            p_tag.extract()  # Remove the empty paragraph
+def keywords_dictionary() -> str:
+    # Indented to line up with the script it goes in
+    return json.dumps(keyword_registry()["menu"], indent=2).replace('\n', '\n' + ' ' * 6)
 
-    print("  Replacing nodes")
-    if main_tag:
-        main_tag.clear()
-        main_tag.append(replacement_soup)
 
-    debug(str(soup), output_path)
-    return str(soup)
+def fill_template(template: 'list[str]', fragments: 'Iterable[str]', keywords: str, keyword_nodes: str,
+                  role_pairs: str, related_nodes: str, payload_script: 'Iterable[str]' = ()) -> 'Iterator[str]':
+    values = {"KEYWORDS_PLACEHOLDER": keywords, "KEYWORD_NODES_PLACEHOLDER": keyword_nodes,
+              "ROLE_PAIRS_PLACEHOLDER": role_pairs, "RELATED_NODES_PLACEHOLDER": related_nodes}
+    for piece in template:
+        if piece == "\nNODES_PLACEHOLDER":
+            yield from fragments
+        elif piece == "\nPAYLOAD_SCRIPT_PLACEHOLDER":
+            yield from payload_script
+        else:
+            yield values.get(piece, piece)
 
 
-def highlight_roles(current_contents: str, output_path: str) -> str:
-    current_contents = surround_keywords_with_span(current_contents, Loric, "Loric")
-    current_contents = surround_keywords_with_span(current_contents, Fabled, "Fabled")
-    current_contents = surround_keywords_with_span(current_contents, Townsfolk, "Townsfolk")
-    current_contents = surround_keywords_with_span(current_contents, Outsider, "Outsider")
-    current_contents = surround_keywords_with_span(current_contents, Minion, "Minion")
-    current_contents = surround_keywords_with_span(current_contents, Demon, "Demon")
-    current_contents = surround_keywords_with_span(current_contents, Traveller, "Traveller")
+def write_page(template: 'list[str]', nodes: 'list[Node]', keyword_nodes: str, role_pairs: str, related_nodes: str,
+               output_path: str) -> int:
+    # The pieces of the template with the keywords and rendered nodes in between, streamed to the file
+    print("  Writing out nodes")
+    page = fill_template(template, (node.fragment() for node in nodes), keywords_dictionary(), keyword_nodes,
+                         role_pairs, related_nodes)
+    size = write_atomically(output_path, page)
 
-    debug(current_contents, output_path)
-    return current_contents
+    new_keyword_count = sum(len(words) for words in keyword_registry()["menu"].values())
+    print(f"  Added {new_keyword_count} keywords to index")
+    return size
+
+
+def payload_chunks(nodes: 'list[Node]') -> 'Iterator[str]':
+    """
+    The nodes as JSON, for the payload page to render: each one's question and answer HTML,
+    the character types it mentions as a bitmask over the types listed first, and its sort key.
+    Nothing in it can end the script it goes in, as </ is written <\\/, which JSON reads the same.
+    """
+    types = sorted(set(role_matcher()[1].values()))
+    bits = {character_type: 1 << bit for bit, character_type in enumerate(types)}
+    yield '{"types":' + json.dumps(types, separators=(',', ':')) + ',"nodes":['
+    for position, node in enumerate(nodes):
+        question, answer = split_rendered_node(node.fragment())
+        mask = sum(bits[character_type] for character_type in {character_type for character_type, role in node.roles})
+        entry = json.dumps([minify(question).strip(), minify(answer).strip(), mask, node_sort_key(node)],
+                           ensure_ascii=False, separators=(',', ':'))
+        yield (',' if position else '') + entry.replace('</', '<\\/')
+    yield ']}'
+
+
+def write_payload_page(template: 'list[str]', nodes: 'list[Node]', keyword_nodes: str, role_pairs: str, related_nodes: str,
+                       output_path: str) -> 'tuple[int, int]':
+    # The guide with its nodes as a payload the page renders as needed. Returns the size of the page and of the payload.
+    with open(PAYLOAD_TEMPLATE_FILE, 'r', encoding="utf-8") as file:
+        before, after = file.read().split("PAYLOAD_PLACEHOLDER", 1)
+    payload_size = 0
+
+    def payload_script() -> 'Iterator[str]':
+        nonlocal payload_size
+        yield "\n    <script> // Nodes from the payload\n" + before
+        for chunk in payload_chunks(nodes):
+            payload_size += len(chunk.encode('utf-8'))
+            yield chunk
+        yield after + "    </script>"
+
+    size = write_atomically(output_path, fill_template(template, [], keywords_dictionary(), keyword_nodes,
+                                                       role_pairs, related_nodes, payload_script()))
+    return size, payload_size
+
+
+def node_texts(parts: 'list[tuple[str, str]]') -> 'list[tuple[str, str]]':
+    # The text of each node's question and answer as a browser would show it, from the nodes in a page or a payload
+    return [(html_text(question), html_text(answer)) for question, answer in parts]
+
+
+def page_nodes(path: str) -> 'list[tuple[str, str]]':
+    # The question and answer HTML of each node in a static guide
+    with open(path, 'r', encoding="utf-8") as file:
+        page = file.read()
+    main = page[page.index("<main>"):page.index("</main>")]
+    return [split_rendered_node('<div class="node">' + fragment) for fragment in main.split('<div class="node">')[1:]]
+
+
+def payload_nodes(path: str) -> 'list[tuple[str, str]]':
+    # The question and answer HTML of each node in a payload page, as renderNode puts them in the page
+    with open(path, 'r', encoding="utf-8") as file:
+        for line in file:
+            if line.strip().startswith("var payload = "):
+                payload = json.loads(line.strip()[len("var payload = "):].rstrip(';'))
+                return [(question, answer) for question, answer, types, sort_key in payload["nodes"]]
+    return []
 
 
-def update_index(html: str, output_path: str) -> str:
-    soup = BeautifulSoup(html, 'html.parser')
-    script_tag = soup.find('script')
+def check_payload_page(payload_path: str, guide_path: str) -> bool:
+    # Compares the text of every node the payload page can render with the static guide, without a browser
+    for path in (payload_path, guide_path):
+        if not os.path.exists(path):
+            print(f"  No {path}, build with --payload first")
+            return False
+    expected = node_texts(page_nodes(guide_path))
+    found = node_texts(payload_nodes(payload_path))
+    if len(found) != len(expected):
+        print(f"  {payload_path} has {len(found)} nodes, but {guide_path} has {len(expected)}")
+        return False
+    differences = [position for position, (texts, expected_texts) in enumerate(zip(found, expected)) if texts != expected_texts]
+    for position in differences[:5]:
+        print(f"  Node {position} differs from {guide_path}: {found[position][0][:60]!r}")
+    if differences:
+        print(f"  {len(differences)} of {len(expected)} nodes in {payload_path} differ from {guide_path}")
+        return False
+    print(f"  The text of all {len(expected)} nodes in {payload_path} matches {guide_path}")
+    return True
 
-    javascript_code = script_tag.string.strip()
 
-    # Locate the 'keywords' dictionary in the JavaScript code
-    start_index = javascript_code.find("var keywords = {") + len("var keywords = {")
-    end_index = javascript_code.find("};", start_index) + 1
-    keywords_str = javascript_code[start_index-1:end_index]
+def page_name(role: str) -> str:
+    return re.sub(r'[^a-z0-9]+', '-', role.lower()).strip('-') + ".html"
 
-    # Convert the new dictionary to a JSON string
-    new_keywords_dict_str = json.dumps(all_the_words, indent=2)
 
-    # Update index
-    javascript_code = javascript_code.replace(keywords_str, new_keywords_dict_str)
-    script_tag.string = javascript_code
+def nodes_by_role(nodes: 'list[Node]') -> 'dict[str, list[Node]]':
+    # The nodes in a role's =Role= section along with every other node that mentions the role, in page order
+    role_types = role_matcher()[1]
+    pages = {role: [] for role in role_types}
+    for node in nodes:
+        roles = {role for character_type, role in node.roles}
+        if node.section in role_types:
+            roles.add(node.section)
+        for role in roles:
+            pages[role].append(node)
+    return pages
+
+
+def page_template(template: 'list[str]', role_pairs: str) -> 'tuple[str, str, str, str]':
+    """
+    The page shell shared by the character pages, whose style sheets and scripts live in files of their own.
+    Returns the page up to and after the nodes, the CSS and the JS.
+    The node positions in keywordNodes and relatedNodes only hold for the full guide, so the pages do without them.
+    """
+    shell = ''.join(fill_template(template, ["\nNODES_PLACEHOLDER"], keywords_dictionary(), "", role_pairs, ""))
+    shell = re.sub(r'\n *var (?:keywordNodes|relatedNodes) = ;', '', shell)
+    shell = shell.replace("</title>", ": ROLE_PLACEHOLDER</title>", 1)
+
+    def move_out(tag: str, replacement: str) -> 'tuple[str, str]':
+        # Every <tag> element goes, with the first one making way for the replacement
+        pattern = re.compile(r'\n( *)<' + tag + r'\b[^>]*>(.*?)</' + tag + '>', re.DOTALL)
+        contents = [match.group(2) for match in pattern.finditer(shell)]
+        replacements = iter(['\n' + pattern.search(shell).group(1) + replacement])
+        return pattern.sub(lambda match: next(replacements, ''), shell), '\n'.join(contents)
+
+    shell, css = move_out('style', '<link href="guide.css" rel="stylesheet"/>')
+    shell, javascript = move_out('script', '<script src="guide.js"></script>')
+    before, after = shell.split("\nNODES_PLACEHOLDER", 1)
+    return before, after, css, javascript
+
+
+def write_atomically(path: str, chunks: 'Iterable[str] | Iterable[bytes]', mode: str = 'w') -> int:
+    # Whatever was at path stays there, whole, until the new file is safely on disk
+    temporary_path = path + ".tmp"
+    try:
+        with open(temporary_path, mode, encoding=None if 'b' in mode else "utf-8") as file:
+            file.writelines(chunks)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, path)
+    except BaseException:   # interrupted, or out of disk space, so the half written file is no use
+        with contextlib.suppress(OSError):
+            os.remove(temporary_path)
+        raise
+    return os.path.getsize(path)
+
+
+def write_pages(template: 'list[str]', nodes: 'list[Node]', role_pairs: str, directory: str) -> None:
+    # One page per role next to a manifest
+    before, after, css, javascript = page_template(template, role_pairs)
+    os.makedirs(directory, exist_ok=True)
+    role_types = role_matcher()[1]
+    pages = {role: role_nodes for role, role_nodes in sorted(nodes_by_role(nodes).items()) if role_nodes}
+
+    def write_role_page(role: str) -> int:
+        chunks = [before.replace("ROLE_PLACEHOLDER", role)] + [node.fragment() for node in pages[role]] + [after]
+        return write_atomically(os.path.join(directory, page_name(role)), chunks)
+
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor() as executor:
+        sizes = dict(zip(pages, executor.map(write_role_page, pages)))
+    shared_size = write_atomically(os.path.join(directory, "guide.css"), [css])
+    shared_size += write_atomically(os.path.join(directory, "guide.js"), [javascript])
+
+    manifest_path = os.path.join(directory, "manifest.json")
+    manifest = {role: {"type": role_types[role], "page": page_name(role), "nodes": len(pages[role]), "bytes": sizes[role]}
+                for role in pages}
+
+    # Pages for roles that have no nodes any more go
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r', encoding="utf-8") as file:
+            previous = json.load(file)
+        for role, entry in previous.items():
+            if role not in manifest and os.path.exists(os.path.join(directory, entry["page"])):
+                os.remove(os.path.join(directory, entry["page"]))
+    manifest_size = write_atomically(manifest_path, [json.dumps(manifest, indent=2)])
+
+    for role, entry in manifest.items():
+        print(f"    {entry['page']:<28}{entry['nodes']:>6} nodes{entry['bytes']:>12,} bytes")
+    skipped = sorted(set(role_types) - set(pages))
+    if skipped:
+        print("  No nodes for " + ", ".join(skipped))
+    total = sum(sizes.values()) + shared_size + manifest_size
+    print(f"  Wrote {len(pages)} pages to {directory}: {total:,} bytes in all, "
+          f"{sum(sizes.values()) // len(pages):,} bytes per page on average and {shared_size:,} bytes of shared CSS and JS")
+
+
+MINIFY_WHITESPACE = re.compile(r'[ \t\n\r\f]*\n[ \t\n\r\f]*')
+
+
+def minify(page: str) -> str:
+    # A run of whitespace holding a line break renders as a single space, and the guide has no <pre>,
+    # nor any JavaScript or CSS string that spans lines, so every such run can shrink to one newline
+    return MINIFY_WHITESPACE.sub('\n', page)
+
+
+def minify_chunks(chunks: 'Iterable[str]') -> 'Iterator[str]':
+    # Whitespace at the end of a chunk is held back, as the run may go on into the next one
+    held = ''
+    for chunk in chunks:
+        text = held + chunk
+        kept = text.rstrip(' \t\n\r\f')
+        held = text[len(kept):]
+        yield minify(kept)
+    yield minify(held)
+
+
+def read_chunks(path: str, mode: str = 'r') -> 'Iterator[str] | Iterator[bytes]':
+    with open(path, mode, encoding=None if 'b' in mode else "utf-8") as file:
+        yield from iter(lambda: file.read(CHUNK_SIZE), b'' if 'b' in mode else '')
+
+
+def zstd_compressor():
+    # The standard library's compressor and zstandard's compressobj both have compress and flush
+    compressor = zstd.ZstdCompressor(level=ZSTD_LEVEL)
+    return compressor.compressobj() if hasattr(compressor, 'compressobj') else compressor
+
+
+def compressors() -> 'list[tuple[str, Callable[[], object]]]':
+    # Each makes a fresh compressor; gzip's is the same as gzip.compress with mtime=0
+    available = [(".gz", lambda: zlib.compressobj(9, zlib.DEFLATED, 31))]
+    if zstd is not None:
+        available.append((".zst", zstd_compressor))
+    return available
+
+
+def compress_chunks(chunks: 'Iterable[bytes]', compressor) -> 'Iterator[bytes]':
+    for chunk in chunks:
+        yield compressor.compress(chunk)
+    yield compressor.flush()
+
+
+def write_deployment_files(indented_path: str, minified_path: str) -> None:
+    # The minified guide, and compressed copies of both guides for a static host to serve as they are.
+    # Everything is streamed from the guide already written, a chunk at a time.
+    write_atomically(minified_path, minify_chunks(read_chunks(indented_path)))
+
+    raw_size = os.path.getsize(indented_path)
+    print(f"    {indented_path:<32}{raw_size:>12,} bytes")
+    for path in (indented_path, minified_path):
+        if path != indented_path:
+            size = os.path.getsize(path)
+            print(f"    {path:<32}{size:>12,} bytes{size / raw_size:>8.1%}")
+        for suffix, compressor in compressors():
+            start = time.perf_counter()
+            size = write_atomically(path + suffix, compress_chunks(read_chunks(path, 'rb'), compressor()), 'wb')
+            seconds = time.perf_counter() - start
+            print(f"    {path + suffix:<32}{size:>12,} bytes{size / raw_size:>8.1%}  in {seconds:.2f} s")
+    if zstd is None:
+        print("  No zstd module, so no .zst copies")
+
+
+HTML_BLOCK = re.compile(r'</?(?:h4|div|p|ul|ol|li)\b[^>]*>')
+HTML_TAG = re.compile(r'<[^>]*>')
+DEPRECATED_HTML = re.compile(r'<div class="deprecated">(.*)</div>', re.DOTALL)
+FTS_LITERAL = re.compile(r"[\w' -]{3,}")    # terms the trigram index can narrow down, as they are not regexes
+SEARCH_REMOVED = re.compile(r"[^a-zA-Z0-9,|'\s-]")     # what sanitiseInput takes out of the search box
+
+
+def html_text(html: str) -> str:
+    # The text of rendered HTML, with a line per paragraph or list item
+    lines = (' '.join(unescape(HTML_TAG.sub('', block)).split()) for block in HTML_BLOCK.split(html))
+    return '\n'.join(line for line in lines if line)
+
+
+class NodeDatabase:
+    """
+    The parsed nodes in SQLite, for tools that answer rules questions without scraping the page.
+    Nodes go in a batch at a time as NodeStore finishes them, all in one transaction, into a new
+    file that replaces the old one once the nodes are in page order.
+    The search table indexes trigrams where SQLite has them, so a term narrows the nodes down before
+    the page's own regex is run over what is left.
+    """
+    SCHEMA = [
+        "CREATE TABLE meta (name TEXT PRIMARY KEY, value TEXT)",
+        "CREATE TABLE nodes (id INTEGER PRIMARY KEY, position INTEGER, section TEXT, "
+        "question TEXT, answer TEXT, deprecated TEXT, html TEXT)",
+        "CREATE TABLE citations (node_id INTEGER, position INTEGER, citation TEXT)",
+        "CREATE TABLE roles (role TEXT, type TEXT, node_id INTEGER, PRIMARY KEY (role, node_id)) WITHOUT ROWID",
+    ]
+    INDEXES = [
+        "CREATE INDEX nodes_position ON nodes (position)",
+        "CREATE INDEX citations_node ON citations (node_id)",
+    ]
+
+    def __init__(self, path: str):
+        self.path = path
+        self.connection = None
+        self.tokenizer = None
+
+    def start(self) -> None:
+        import sqlite3
+        self.abandon()      # anything left over from a build that failed
+        connection = self.connection = sqlite3.connect(self.path + ".tmp", isolation_level=None)
+        connection.execute("PRAGMA journal_mode = OFF")     # a new file that is only kept once it is complete
+        connection.execute("PRAGMA synchronous = OFF")
+        connection.execute("BEGIN")
+        for statement in self.SCHEMA:
+            connection.execute(statement)
+
+        # Trigrams find any substring, as the page's search does; the default tokenizer only finds whole words
+        self.tokenizer = None
+        for tokenizer in ("trigram", "unicode61"):
+            try:
+                connection.execute("CREATE VIRTUAL TABLE search USING fts5(question, answer, deprecated, "
+                                   f"content='nodes', content_rowid='id', tokenize='{tokenizer}')")
+            except sqlite3.OperationalError:    # an older SQLite, or one without FTS5
+                continue
+            self.tokenizer = tokenizer
+            break
+
+    def add(self, nodes: 'list[Node]', parts: 'list[tuple[str, str]]') -> None:
+        rows, citations, roles = [], [], []
+        for node, (question, answer) in zip(nodes, parts):
+            deprecated = DEPRECATED_HTML.search(answer)
+            if deprecated:
+                answer = answer[:deprecated.start()] + answer[deprecated.end():]
+            rows.append((node.id, node.section or None, html_text(question), html_text(answer),
+                         html_text(deprecated.group(1)) if deprecated else None, node.html))
+            citations.extend((node.id, position, citation) for position, citation in enumerate(node.citations))
+            roles.extend((role, character_type, node.id) for character_type, role in node.roles)
+        self.connection.executemany("INSERT INTO nodes (id, section, question, answer, deprecated, html) "
+                                    "VALUES (?, ?, ?, ?, ?, ?)", rows)
+        self.connection.executemany("INSERT INTO citations VALUES (?, ?, ?)", citations)
+        self.connection.executemany("INSERT INTO roles VALUES (?, ?, ?)", roles)
+
+    def finish(self, nodes: 'list[Node]') -> int:
+        # Puts the nodes in page order, indexes them and swaps the new file in. Returns its size.
+        connection = self.connection
+        connection.executemany("UPDATE nodes SET position = ? WHERE id = ?",
+                               ((position, node.id) for position, node in enumerate(nodes)))
+        for statement in self.INDEXES:
+            connection.execute(statement)
+        if self.tokenizer is not None:
+            connection.execute("INSERT INTO search (search) VALUES ('rebuild')")
+        connection.executemany("INSERT INTO meta VALUES (?, ?)", [("source", BOTC_DATA_FILE),
+                                                                   ("built", datetime.now().isoformat(timespec='seconds')),
+                                                                   ("tokenizer", self.tokenizer)])
+        connection.execute("COMMIT")
+        connection.close()
+        self.connection = None
+        os.replace(self.path + ".tmp", self.path)
+        return os.path.getsize(self.path)
+
+    def abandon(self) -> None:
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+        if os.path.exists(self.path + ".tmp"):
+            os.remove(self.path + ".tmp")
+
+
+def query_term(connection: 'sqlite3.Connection', term: str, tokenizer: 'str | None', candidates: 'set[int] | None') -> 'set[int]':
+    # The nodes matching one term of the search box, out of the candidates if there are any.
+    # Role names are searched for like any other term, as the roles table misses mentions the highlighter
+    # left alone, such as an emphasised name, which the search box still finds.
+    if tokenizer == "trigram" and FTS_LITERAL.fullmatch(term):
+        rows = connection.execute("SELECT id, html FROM nodes WHERE id IN (SELECT rowid FROM search WHERE search MATCH ?)",
+                                  ('"' + term.replace('"', '""') + '"',))
+    else:
+        rows = connection.execute("SELECT id, html FROM nodes")
+    regex = keyword_regex(term)
+
+    found = set()
+    for node_id, html in rows:
+        if candidates is not None and node_id not in candidates:
+            continue
+        question, answer = split_rendered_node(html)
+        if regex.search(question) or regex.search(answer):
+            found.add(node_id)
+    return found
+
+
+def sanitise_query(query: str) -> str:
+    # The same as sanitiseInput on the page, which leaves nothing in a search that a regex would treat specially
+    return SEARCH_REMOVED.sub('', query)
+
+
+def query_nodes(connection: 'sqlite3.Connection', query: str) -> 'set[int]':
+    # The same syntax as the search box: every comma separated term has to match, and any one of a term's | alternatives
+    tokenizer = connection.execute("SELECT value FROM meta WHERE name = 'tokenizer'").fetchone()[0]
+    found = None
+    for term in [term.strip() for term in sanitise_query(query).split(',') if term.strip()]:
+        alternatives = [alternative.strip() for alternative in term.split('|')]
+        if '' in alternatives:  # buildRegex gives nothing to match, and matching nothing always succeeds
+            continue
+        matches = set()
+        for alternative in alternatives:
+            matches |= query_term(connection, alternative, tokenizer, found)
+        found = matches
+        if not found:
+            break
+    if found is None:   # no terms, and the page shows every node
+        found = {node_id for node_id, in connection.execute("SELECT id FROM nodes")}
+    return found
+
+
+def run_query(path: str, query: str) -> bool:
+    # Prints the matching nodes in page order, in the same form as BotC.txt
+    if not os.path.exists(path):
+        print(f"  No {path}, build with --export-db first")
+        return False
+    import sqlite3
+    start = time.perf_counter()
+    connection = sqlite3.connect(path)
+    found = json.dumps(sorted(query_nodes(connection, query)))
+    nodes = connection.execute("SELECT id, section, question, answer, deprecated FROM nodes "
+                               "WHERE id IN (SELECT value FROM json_each(?)) ORDER BY position", (found,)).fetchall()
+    citations = {}
+    for node_id, citation in connection.execute("SELECT node_id, citation FROM citations WHERE node_id IN "
+                                                "(SELECT value FROM json_each(?)) ORDER BY node_id, position", (found,)):
+        citations.setdefault(node_id, []).append(citation)
+    connection.close()
+    milliseconds = (time.perf_counter() - start) * 1000
+
+    for node_id, section, question, answer, deprecated in nodes:
+        print()
+        if section:
+            print("=" + section + "=")
+        print("Q " + question.replace('\n', '\n  '))
+        print("A " + answer.replace('\n', '\n  '))
+        if deprecated:
+            print("D " + deprecated.replace('\n', '\n  '))
+        for citation in citations.get(node_id, []):
+            print("C " + citation)
+    print()
+    print(f"  {len(nodes)} nodes found for '{query}', in {milliseconds:.1f} ms")
+    return True
 
-    new_keyword_count = sum(len(words) for words in all_the_words.values())
-    print(f"  Added {new_keyword_count} keywords to index")
 
-    debug(str(soup), output_path)
-    return str(soup)
+def normalise_query(query: str) -> 'tuple[tuple[str, ...], ...]':
+    # The terms as updateFiltering splits them once sanitiseInput has cleaned the query, each one a tuple
+    # of its | alternatives. Every term has to match, so their order makes no difference to the results.
+    terms = [term.strip() for term in sanitise_query(query).split(',') if term.strip()]
+    return tuple(sorted(tuple(alternative.strip() for alternative in term.split('|')) for term in terms))
+
+
+class GuideIndex:
+    """
+    The nodes of one build, in page order, and the keyword index that went into the page,
+    searched the way updateFiltering searches the page.
+    """
+    def __init__(self, nodes: 'list[Node]', keyword_nodes: str):
+        self.sections = [node.section for node in nodes]
+        self.parts = [split_rendered_node(node.fragment()) for node in nodes]
+        self.keyword_nodes = json.loads(keyword_nodes)
+        self.indexed = {}   # keyword menu entries whose positions have been read from the index
+
+    def indexed_nodes(self, term: str) -> 'frozenset[int] | None':
+        # The same as indexedNodes on the page
+        if term not in self.keyword_nodes:
+            return None
+        if term not in self.indexed:
+            entry = self.keyword_nodes[term]
+            if isinstance(entry, str):     # a bitset, one bit per node
+                bits = base64.b64decode(entry)
+                entry = [index * 8 + bit for index, byte in enumerate(bits) if byte for bit in range(8) if byte >> bit & 1]
+            self.indexed[term] = frozenset(entry)
+        return self.indexed[term]
+
+    def search(self, terms: 'tuple[tuple[str, ...], ...]') -> 'list[int]':
+        # The positions of the nodes the page would show. Terms in the keyword index narrow the nodes down
+        # before the rest are searched for, which the page only does when every term is in the index.
+        found = set(range(len(self.parts)))
+        unindexed = []
+        for alternatives in terms:
+            positions = self.indexed_nodes(' | '.join(alternatives))
+            if positions is None:
+                unindexed.append(alternatives)
+            else:
+                found &= positions
+
+        for alternatives in unindexed:
+            if '' in alternatives:  # buildRegex gives nothing to match, and matching nothing always succeeds
+                continue
+            regexes = [keyword_regex(alternative) for alternative in alternatives]
+            found = {position for position in found
+                     if any(regex.search(part) for regex in regexes for part in self.parts[position])}
+        return sorted(found)
+
+
+def percentile(ordered: 'list[float]', fraction: float) -> float:
+    # Nearest rank
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class GuideServer:
+    """
+    Answers searches over HTTP from the nodes of the latest build, so other tools need not load the page.
+    GET /search?q=A, B | C returns the matching nodes as JSON, and GET /stats how the server is doing.
+    Rebuilds happen on another thread, which swaps a new index in along with an empty cache once it is ready.
+    """
+    def __init__(self):
+        self.current = None     # the index and its cached search, swapped together
+        self.started = time.perf_counter()
+        self.requests = 0
+        self.errors = 0
+        self.reloads = 0
+        self.latencies = deque(maxlen=SERVE_LATENCY_WINDOW)
+        self.earlier_hits = 0   # cache hits and misses before the last reload
+        self.earlier_misses = 0
+
+    def load(self, nodes: 'list[Node]', keyword_nodes: str) -> None:
+        index = GuideIndex(nodes, keyword_nodes)
+        if self.current is not None:
+            info = self.current[1].cache_info()
+            self.earlier_hits += info.hits
+            self.earlier_misses += info.misses
+            self.reloads += 1
+        self.current = index, functools.lru_cache(maxsize=SERVE_CACHE_SIZE)(index.search)
+        print(f"  Serving {len(index.parts)} nodes")
+
+    def search(self, query: str, limit: 'int | None') -> dict:
+        index, search = self.current
+        terms = normalise_query(query)
+        positions = search(terms)
+        results = [{"position": position, "section": index.sections[position],
+                    "question": index.parts[position][0], "answer": index.parts[position][1]}
+                   for position in positions[:limit]]
+        return {"query": query, "count": len(positions), "nodes": results}
+
+    def stats(self) -> dict:
+        uptime = time.perf_counter() - self.started
+        latencies = sorted(self.latencies)
+        info = self.current[1].cache_info()
+        hits, misses = self.earlier_hits + info.hits, self.earlier_misses + info.misses
+        return {"nodes": len(self.current[0].parts),
+                "reloads": self.reloads,
+                "uptime_seconds": round(uptime, 1),
+                "requests": self.requests,
+                "errors": self.errors,
+                "requests_per_second": round(self.requests / uptime, 2),
+                "latency_ms": {name: round(percentile(latencies, fraction) * 1000, 3)
+                               for name, fraction in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("max", 1.0))},
+                "cache": {"size": info.currsize, "max_size": info.maxsize, "hits": hits, "misses": misses,
+                          "hit_rate": round(hits / (hits + misses), 3) if hits + misses else 0.0}}
+
+    def respond(self, method: str, target: str) -> 'tuple[int, dict]':
+        if method != 'GET':
+            return 405, {"error": "only GET is supported"}
+        from urllib.parse import parse_qs, urlsplit
+        url = urlsplit(target)
+        parameters = parse_qs(url.query)
+        if url.path == '/search':
+            try:
+                limit = int(parameters["limit"][0]) if "limit" in parameters else None
+                if limit is not None and limit < 0:     # a slice would quietly drop results from the end
+                    return 400, {"error": "limit cannot be negative"}
+                return 200, self.search(parameters.get("q", [""])[0], limit)
+            except ValueError:
+                return 400, {"error": "limit has to be a whole number"}
+        if url.path == '/stats':
+            return 200, self.stats()
+        return 404, {"error": "try /search?q=... or /stats"}
+
+    async def handle(self, reader: 'asyncio.StreamReader', writer: 'asyncio.StreamWriter') -> None:
+        # Requests on one connection are answered in turn until the client is done with it.
+        # Answers are worked out on the loop's thread pool, so a slow search holds up nobody else.
+        import asyncio
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    request_line = await reader.readline()
+                    if not request_line.strip():
+                        break
+                    start = time.perf_counter()
+                    headers = {}
+                    while (line := await reader.readline()).strip():
+                        name, _, value = line.decode('latin-1').partition(':')
+                        headers[name.strip().lower()] = value.strip().lower()
+                except (ValueError, asyncio.IncompleteReadError):     # a line longer than the reader's limit
+                    start = time.perf_counter()
+                    status, body, keep_alive = 431, {"error": "request line or headers too long"}, False
+                else:
+                    try:
+                        method, target, version = request_line.decode('latin-1').split()
+                    except ValueError:
+                        status, body, method, version = 400, {"error": "malformed request"}, None, "HTTP/1.0"
+                    else:
+                        status, body = await loop.run_in_executor(None, self.respond, method, target)
+                    # Request bodies are never read, so after anything but a GET the next request cannot be found
+                    keep_alive = method == 'GET' and version == "HTTP/1.1" and headers.get("connection") != "close"
+
+                data = json.dumps(body).encode('utf-8')
+                reason = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+                          431: "Request Header Fields Too Large"}[status]
+                writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n"
+                             f"Content-Length: {len(data)}\r\nConnection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+                             .encode('latin-1') + data)
+                await writer.drain()
+                self.requests += 1
+                self.errors += status != 200
+                self.latencies.append(time.perf_counter() - start)
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str, port: int) -> None:
+        import asyncio
+        server = await asyncio.start_server(self.handle, host, port)
+        self.started = time.perf_counter()
+        print(f"Serving searches on http://{host}:{port}/search?q=... and http://{host}:{port}/stats, press Ctrl+C to stop ...")
+        async with server:
+            await server.serve_forever()
+
+    def run(self, host: str, port: int) -> None:
+        import asyncio
+        try:
+            asyncio.run(self.serve(host, port))
+        except KeyboardInterrupt:
+            print("Stopped serving.")
+
+
+@functools.lru_cache(maxsize=None)
+def role_matcher() -> 'tuple[re.Pattern, dict[str, str]]':
+    registry = keyword_registry()
+    return re.compile(registry["pattern"]), registry["role types"]
+
+
+def split_rendered_node(html: str) -> 'tuple[str, str]':
+    # The inner HTML of a rendered node's question and answer, found without parsing it
+    question_start = html.find('<h4 class="question">') + len('<h4 class="question">')
+    question = html[question_start:html.find('</h4>', question_start)]
+
+    answer = ""
+    answer_start = html.find('<div class="answer">')
+    if answer_start != -1:
+        answer_start += len('<div class="answer">')
+        answer_end = html.rfind('</div>', answer_start, html.rfind('</div>'))   # the last </div> closes the node
+        answer = html[answer_start:answer_end]
+    return question, answer
+
+
+@functools.lru_cache(maxsize=None)
+def keyword_regex(term: str) -> 're.Pattern':
+    # The same as buildRegex on the page. Keywords never contain < or >, so checking that the
+    # match is not inside a tag can wait until after the term itself has matched, which is far quicker.
+    if term[:1] == term[:1].upper():
+        return re.compile(f'({term})(?![^<]*>)(?![a-zA-Z])')   # not a substring, case sensitive
+    return re.compile(f'({term})(?![^<]*>)', re.IGNORECASE)     # case insensitive, substrings allowed
+
+
+def find_keyword_nodes(parts: 'list[tuple[str, str]]', terms: 'Iterable[str]') -> 'dict[str, list[int]]':
+    # Every question and answer goes into one string, so each term is one regex scan over the whole guide.
+    # The separator starts with < so nothing carries over from one question or answer to the next.
+    separator = "<\x00>"
+    texts = [text for question, answer in parts for text in (question, answer)]
+    starts = []
+    position = 0
+    for text in texts:
+        starts.append(position)
+        position += len(text) + len(separator)
+    haystack = separator.join(texts)
+
+    keyword_nodes = {}
+    for term in terms:
+        regex = keyword_regex(term)
+        found = []
+        position = 0
+        while True:
+            match = regex.search(haystack, position)
+            if match is None:
+                break
+            node = (bisect.bisect_right(starts, match.start()) - 1) // 2
+            found.append(node)
+            position = starts[2 * node + 2] if 2 * node + 2 < len(starts) else len(haystack)   # on to the next node
+        keyword_nodes[term] = found
+    return keyword_nodes
+
+
+def index_terms() -> 'list[str]':
+    # Each entry from the keyword menu, and each of its | alternatives, as updateFiltering splits them
+    return keyword_registry()["terms"]
+
+
+@functools.lru_cache(maxsize=None)
+def index_single_terms() -> 'list[str]':
+    # The terms that are searched for; those with | alternatives are found through them
+    return [term for term in index_terms() if '|' not in term]
+
+
+def index_keyword_nodes(nodes: 'list[Node]', output_path: str) -> str:
+    # The keywordNodes object, for the nodes in page order, from the terms NodeStore found in each node
+    terms = index_terms()
+    single_terms = index_single_terms()
+
+    found_in = [array('I') for term in single_terms]
+    for position, node in enumerate(nodes):
+        found = node.terms
+        while found:
+            lowest = found & -found
+            found_in[lowest.bit_length() - 1].append(position)
+            found ^= lowest
+    alternatives = dict(zip(single_terms, found_in))
+
+    # Node positions are stored as a list, or as a base64 encoded bitset when that is shorter
+    keyword_nodes = {}
+    for term in terms:
+        if '|' in term:
+            found = sorted(set().union(*(alternatives[alternative.strip()] for alternative in term.split('|'))))
+        else:
+            found = alternatives[term].tolist()
+        bits = bytearray((len(nodes) + 7) // 8)
+        for node in found:
+            bits[node // 8] |= 1 << (node % 8)
+        bitset = base64.b64encode(bytes(bits)).decode('ascii')
+        positions = json.dumps(found, separators=(',', ':'))
+        keyword_nodes[term] = bitset if len(bitset) + 2 < len(positions) else found
+
+    index = json.dumps(keyword_nodes, separators=(',', ':'))
+
+    size = len(index.encode('utf-8'))
+    print(f"  Indexed {len(terms)} keywords over {len(nodes)} nodes: {size:,} bytes")
+    if size > KEYWORD_NODES_BUDGET:
+        print(f"  The keyword index is over its budget of {KEYWORD_NODES_BUDGET:,} bytes")
+
+    debug(index, output_path)
+    return index
+
+
+def node_sort_key(node: Node) -> int:
+    # Nodes mentioning fewer distinct characters come first; Loric does not count
+    return sum(1 for character_type, role in node.roles if character_type != "Loric")
+
+
+def reorder_nodes(nodes: 'list[Node]', output_path: str) -> 'list[Node]':
+    nodes = sorted(nodes, key=node_sort_key)
+
+    debug(lambda: render_nodes(nodes), output_path)
+    return nodes
+
+
+class RoleGraph:
+    """
+    Which roles each node mentions, in page order: the numbers of the node's roles in self.roles are
+    self.mentions[self.offsets[position]:self.offsets[position + 1]], a sparse role by node incidence matrix.
+    From it come how many nodes mention each pair of roles, and the questions related to each node.
+    """
+    def __init__(self, nodes: 'list[Node]'):
+        self.roles = sorted({role for node in nodes for character_type, role in node.roles})
+        numbers = {role: number for number, role in enumerate(self.roles)}
+        self.mentions = array('H')
+        self.offsets = array('I', [0])
+        for node in nodes:
+            self.mentions.extend(sorted(numbers[role] for character_type, role in node.roles))
+            self.offsets.append(len(self.mentions))
+
+    def node_roles(self, position: int) -> array:
+        return self.mentions[self.offsets[position]:self.offsets[position + 1]]
+
+    def groups(self, position: int) -> 'Iterator[tuple[int, ...]]':
+        # Each of the node's roles on its own, and each pair of them
+        roles = self.node_roles(position)
+        yield from ((role,) for role in roles)
+        yield from itertools.combinations(roles, 2)
+
+    def pair_counts(self) -> 'dict[tuple[int, int], int]':
+        counts = {}
+        for position in range(len(self.offsets) - 1):
+            for pair in itertools.combinations(self.node_roles(position), 2):
+                counts[pair] = counts.get(pair, 0) + 1
+        return counts
+
+    def related(self, count: int) -> 'list[list[int]]':
+        """
+        For each node, up to count others, roughly those sharing the most roles with it first and then in page order.
+        Only the first 2 * count nodes to mention each role and each pair of roles are candidates, so the work grows
+        with the nodes and the roles they mention rather than with pairs of nodes. The ranking is not exact: a node
+        sharing three or more roles is missed when every pair of them already lists 2 * count nodes further up, and
+        then one sharing fewer, or as many but further down the page, can take its place. Ranking by counting every
+        node that mentions each role is exact, but that grows with pairs of nodes.
+        """
+        positions = range(len(self.offsets) - 1)
+        firsts = {}
+        for position in positions:
+            for group in self.groups(position):
+                found = firsts.setdefault(group, [])
+                if len(found) < 2 * count:
+                    found.append(position)
+        role_sets = [frozenset(self.node_roles(position)) for position in positions]
+
+        related = []
+        for position in positions:
+            roles = role_sets[position]
+            sharing_two = {candidate for pair in itertools.combinations(self.node_roles(position), 2) for candidate in firsts[pair]}
+            sharing_two.discard(position)
+            ranked = [candidate for shared, candidate in sorted([(-len(roles & role_sets[candidate]), candidate)
+                                                                 for candidate in sharing_two])[:count]]
+            if len(ranked) < count:
+                # Then no list of nodes mentioning two of its roles was cut short, so from here it is exact:
+                # every node left shares just one
+                sharing_one = {candidate for role in roles for candidate in firsts[role,]} - sharing_two
+                sharing_one.discard(position)
+                ranked += sorted(sharing_one)[:count - len(ranked)]
+            related.append(ranked)
+        return related
+
+
+def relate_nodes(nodes: 'list[Node]') -> 'tuple[str, str]':
+    # The rolePairs and relatedNodes objects, for the nodes in page order
+    start = time.perf_counter()
+    graph = RoleGraph(nodes)
+    role_pairs = {}
+    for (first, second), count in sorted(graph.pair_counts().items()):
+        role_pairs.setdefault(graph.roles[first], {})[graph.roles[second]] = count
+    related = graph.related(RELATED_NODES)
+
+    pairs = json.dumps(role_pairs, separators=(',', ':'))
+    related_nodes = json.dumps(related, separators=(',', ':'))
+    print(f"  {sum(len(counts) for counts in role_pairs.values())} pairs of {len(graph.roles)} roles in {len(pairs.encode('utf-8')):,} bytes, "
+          f"{RELATED_NODES} related questions for {sum(1 for found in related if found)} nodes in {len(related_nodes):,} bytes, "
+          f"in {time.perf_counter() - start:.2f} s")
+    return pairs, related_nodes
+
+
+ROLE_SPAN = re.compile(r'<span class="\w+">([^<]*)</span>')
+WORD = re.compile(r"[a-z0-9']+")
+
+
+def shingles(text: str) -> 'frozenset[int]':
+    # Each pair of neighbouring words, or the only word, hashed to keep tens of thousands of them small
+    words = WORD.findall(text.lower())
+    return frozenset(zlib.crc32(' '.join(words[index:index + 2]).encode('utf-8')) % MINHASH_PRIME
+                     for index in range(max(1, len(words) - 1)))
+
+
+def minhash_parameters() -> 'tuple[list[int], list[int]]':
+    # One a * x + b mod MINHASH_PRIME per hash, the same from one run to the next
+    rng = random.Random(0)
+    return ([rng.randrange(1, MINHASH_PRIME) for _ in range(MINHASH_HASHES)],
+            [rng.randrange(MINHASH_PRIME) for _ in range(MINHASH_HASHES)])
+
+
+@functools.lru_cache(maxsize=None)
+def load_numpy():
+    # NumPy is optional, and only imported for --dedupe-report, which it makes quicker: pip install numpy
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def minhash_signatures(shingle_sets: 'list[frozenset[int]]') -> 'list[bytes]':
+    # For each set and each hash, the smallest hash of any of its shingles, as 4 bytes
+    numpy = load_numpy()
+    multipliers, offsets = minhash_parameters()
+    if numpy is None:
+        return [array('I', [min((a * x + b) % MINHASH_PRIME for x in values) for a, b in zip(multipliers, offsets)]).tobytes()
+                for values in shingle_sets]
+
+    # Every shingle of a few hundred sets is hashed at once, and each set's minimum taken from its run of columns
+    a = numpy.array(multipliers, dtype=numpy.uint64)[:, None]
+    b = numpy.array(offsets, dtype=numpy.uint64)[:, None]
+    signatures = []
+    for start in range(0, len(shingle_sets), 512):
+        chunk = shingle_sets[start:start + 512]
+        starts = numpy.cumsum([0] + [len(values) for values in chunk[:-1]])
+        hashes = a * numpy.fromiter((x for values in chunk for x in values), dtype=numpy.uint64)
+        hashes += b
+        hashes %= MINHASH_PRIME
+        minimums = numpy.ascontiguousarray(numpy.minimum.reduceat(hashes, starts, axis=1).T, dtype=numpy.uint32)
+        signatures.extend(row.tobytes() for row in minimums)
+    return signatures
+
+
+def candidate_pairs(signatures: 'list[bytes]', groups: 'list[int]') -> 'set[tuple[int, int]]':
+    # Locality sensitive hashing: sets in the same group whose signatures agree on a whole band are candidates,
+    # which finds alike sets in time that grows with the number of sets rather than pairs of them
+    width = MINHASH_HASHES // DEDUPE_BANDS * 4
+    pairs = set()
+    for start in range(0, DEDUPE_BANDS * width, width):
+        buckets = {}
+        for index, key in enumerate(zip(groups, [signature[start:start + width] for signature in signatures])):
+            buckets.setdefault(key, []).append(index)
+        for bucket in buckets.values():
+            if len(bucket) > 1:
+                pairs.update(itertools.combinations(bucket, 2))
+    return pairs
+
+
+def jaccard(a: frozenset, b: frozenset) -> float:
+    return len(a & b) / len(a | b)
+
+
+def verdict(answer: str) -> 'str | None':
+    # Yes or No, if that is how the answer starts
+    first = WORD.match(answer.lower())
+    return first.group(0).capitalize() if first and first.group(0) in ("yes", "no") else None
+
+
+def dedupe_report(nodes: 'list[Node]', output_path: str) -> int:
+    """
+    Finds questions asked more than once, which may have been answered differently.
+    Questions are alike when they mention the same roles and share enough of their word pairs;
+    MinHash and LSH find the candidates, which are then compared in full.
+    Writes the clusters of alike questions to output_path and returns the number of them.
+    """
+    start = time.perf_counter()
+    questions, roles = [], []
+    for node in nodes:
+        question = split_rendered_node(node.fragment())[0]
+        questions.append(html_text(question))
+        roles.append(frozenset(ROLE_SPAN.findall(question)))
+    shingle_sets = [shingles(question) for question in questions]
+    shingled = time.perf_counter()
+    signatures = minhash_signatures(shingle_sets)
+    signed = time.perf_counter()
+    # Questions about different roles are never alike, so only those about the same ones are paired up
+    role_sets = {}
+    candidates = candidate_pairs(signatures, [role_sets.setdefault(question_roles, len(role_sets)) for question_roles in roles])
+    banded = time.perf_counter()
+
+    pairs = {}
+    for first, second in candidates:
+        similarity = jaccard(shingle_sets[first], shingle_sets[second])
+        if similarity >= DEDUPE_THRESHOLD:
+            pairs[first, second] = similarity
+
+    # Alike questions are gathered into clusters, by union-find
+    parents = {}
+
+    def root(index: int) -> int:
+        while parents.setdefault(index, index) != index:
+            parents[index] = parents[parents[index]]
+            index = parents[index]
+        return index
+
+    for first, second in pairs:
+        parents[root(first)] = root(second)
+    clusters = {}
+    for index in sorted(parents):
+        clusters.setdefault(root(index), []).append(index)
+    clusters = sorted(clusters.values(), key=lambda cluster: (-len(cluster), cluster[0]))
+    answers = {index: html_text(DEPRECATED_HTML.sub('', split_rendered_node(nodes[index].fragment())[1])) for index in parents}
+    verified = time.perf_counter()
+
+    lines = [f"Questions asked more than once in {BOTC_DATA_FILE}: {len(clusters)} clusters of {len(pairs)} alike pairs", ""]
+    disagreements = 0
+    for number, cluster in enumerate(clusters, 1):
+        lines.append(f"Cluster {number}, {len(cluster)} questions:")
+        for label, index in enumerate(cluster, 1):
+            lines.append(f"  {label}. [{nodes[index].section or 'General'}] {questions[index]}")
+            lines.append("       " + answers[index].split('\n', 1)[0])
+        labels = {index: label for label, index in enumerate(cluster, 1)}
+        for first, second in sorted(pair for pair in pairs if pair[0] in labels):
+            verdicts = verdict(answers[first]), verdict(answers[second])
+            disagree = None not in verdicts and verdicts[0] != verdicts[1]
+            disagreements += disagree
+            lines.append(f"  {labels[first]} ~ {labels[second]}: {pairs[first, second]:.0%} alike, answers "
+                         + (f"DISAGREE ({verdicts[0]} / {verdicts[1]})" if disagree
+                            else f"{jaccard(shingles(answers[first]), shingles(answers[second])):.0%} alike"))
+        lines.append("")
+    size = write_atomically(output_path, ['\n'.join(lines)])
+
+    print(f"  {len(nodes)} questions shingled in {shingled - start:.2f} s, "
+          f"signed in {signed - shingled:.2f} s with {'NumPy' if load_numpy() else 'pure Python, pip install numpy to speed this up'}")
+    print(f"  {len(candidates)} candidate pairs from LSH in {banded - signed:.2f} s, "
+          f"{len(pairs)} alike pairs in {len(clusters)} clusters in {verified - banded:.2f} s")
+    print(f"  {disagreements} pairs answered Yes and No, see {output_path} ({size:,} bytes)")
+    return len(clusters)
+
+
+def build(template: 'list[str]', cache: BuildCache, found_terms: 'dict[tuple[str, str], int]',
+          options: argparse.Namespace, profiler: StageProfiler, jobs: int,
+          loaded: 'Callable[[list[Node], str], None]' = None) -> bool:
+    # Everything from BotC.txt to the saved guide. Returns False if BotC.txt is not formatted correctly.
+    # loaded is given the nodes in page order and the keyword index while their rendered HTML is still at hand.
+    print("Checking, nodifying, highlighting and rendering " + BOTC_DATA_FILE + " ...")
+    cache.start()
+    database = NodeDatabase(DATABASE_FILE) if options.export_db else None
+    if database is not None:
+        database.start()
+    store = NodeStore(cache, found_terms, database)
+    format_errors = []
+    try:
+        if jobs > 1:
+            with profiler.stage("render_in_parallel"):
+                blocks = list(read_blocks(BOTC_DATA_FILE, format_errors))
+                nodes = None if format_errors else render_in_parallel(blocks, store, jobs)
+            if nodes is None and not format_errors:
+                store.close()
+                cache.start()
+                if database is not None:
+                    database.start()
+                store = NodeStore(cache, found_terms, database)
+                with profiler.stage("text_to_nodes"):
+                    nodes = text_to_nodes(blocks, 'nodefied content.txt', store)
+            del blocks
+        else:
+            with profiler.stage("text_to_nodes"):
+                nodes = text_to_nodes(read_blocks(BOTC_DATA_FILE, format_errors), 'nodefied content.txt', store)
+        if format_errors:
+            print(describe_format_errors(BOTC_DATA_FILE, format_errors))
+            return False
+        print("  " + BOTC_DATA_FILE + " is correctly formatted.")
+        with profiler.stage("save_build_cache"):
+            cache.save()
+
+        print("Ordering nodes ...")
+        with profiler.stage("reorder_nodes"):
+            nodes = reorder_nodes(nodes, 'reordered_nodes.html')
+
+        if database is not None:
+            print("Exporting nodes to " + DATABASE_FILE + " ...")
+            with profiler.stage("export_database"):
+                size = database.finish(nodes)
+            print(f"  {size:,} bytes, searched with the {database.tokenizer or 'no'} tokenizer")
+
+        print("Indexing keywords ...")
+        with profiler.stage("index_keyword_nodes"):
+            keyword_nodes = index_keyword_nodes(nodes, "indexed_keywords.js")
+
+        print("Relating nodes by the roles they mention ...")
+        with profiler.stage("relate_nodes"):
+            role_pairs, related_nodes = relate_nodes(nodes)
+
+        print("Placing updated nodes and index in guide and saving it ...")
+        with profiler.stage("write_page"):
+            size = write_page(template, nodes, keyword_nodes, role_pairs, related_nodes, RESULT_FILE)
+        print(f"  {size:,} bytes, of which the keyword index is {len(keyword_nodes.encode('utf-8')) / size:.1%} "
+              f"and the related roles and questions {(len(role_pairs.encode('utf-8')) + len(related_nodes)) / size:.1%}")
+
+        if options.deploy:
+            print("Writing deployment files ...")
+            with profiler.stage("write_deployment_files"):
+                write_deployment_files(RESULT_FILE, MINIFIED_FILE)
+
+        if options.payload:
+            print("Writing the payload page and checking it against the guide ...")
+            with profiler.stage("write_payload_page"):
+                size, payload_size = write_payload_page(template, nodes, keyword_nodes, role_pairs, related_nodes, PAYLOAD_FILE)
+            print(f"  {len(nodes)} nodes in a {payload_size:,} byte payload, {size:,} bytes in all, "
+                  f"against {os.path.getsize(RESULT_FILE):,} bytes for {RESULT_FILE}")
+            with profiler.stage("check_payload_page"):
+                check_payload_page(PAYLOAD_FILE, RESULT_FILE)
+
+        if options.dedupe_report:
+            print("Looking for questions asked more than once ...")
+            with profiler.stage("dedupe_report"):
+                dedupe_report(nodes, DEDUPE_REPORT_FILE)
+
+        if options.pages:
+            print("Writing character pages ...")
+            with profiler.stage("write_pages"):
+                write_pages(template, nodes, role_pairs, PAGES_DIR)
+
+        if loaded is not None:
+            print("Loading nodes into the server ...")
+            with profiler.stage("load_server"):
+                loaded(nodes, keyword_nodes)
+    finally:
+        store.close()
+        cache.abandon()     # only if the build failed before the cache was saved
+        if database is not None:
+            database.abandon()      # only if the build failed before the database was finished
+
+    rss = peak_rss()
+    memory = "unknown" if rss is None else f"{rss / 2**20:.1f} MB resident"
+    if profiler.enabled:
+        memory += f", {profiler.peak_bytes() / 2**20:.1f} MB traced by tracemalloc"
+    print("  Peak memory: " + memory)
+    return True
 
 
-def indent_keywords(html: str) -> str:
-    updated_content = []
-    found_start = False
+def file_signature(path: str) -> 'tuple[int, int] | None':
+    try:
+        status = os.stat(path)
+    except FileNotFoundError:   # some editors save by writing a new file and renaming it
+        return None
+    return status.st_mtime_ns, status.st_size
+
+
+def watch(path: str, rebuild: 'Callable[[], bool]') -> None:
+    print(f"Watching {path} for changes, press Ctrl+C to stop ...")
+    last = file_signature(path)
+    try:
+        while True:
+            time.sleep(WATCH_INTERVAL)
+            current = file_signature(path)
+            if current == last or current is None:
+                continue
+
+            # A save can come in several writes, so wait for the file to settle
+            while True:
+                time.sleep(WATCH_DEBOUNCE)
+                settled = file_signature(path)
+                if settled == current:
+                    break
+                current = settled
+            last = current
+            if current is None:
+                continue
+
+            start = time.perf_counter()
+            try:
+                rebuilt = rebuild()
+            except Exception as error:  # one bad rebuild should not stop the next save being picked up
+                print(f"  Rebuild failed: {type(error).__name__}: {error}")
+                rebuilt = False
+            if rebuilt:
+                print(f"Rebuilt in {time.perf_counter() - start:.2f} s, {time.time() - current[0] / 1e9:.2f} s after the save.")
+            else:
+                print("  Not rebuilt, fix " + path + " and save it again.")
+    except KeyboardInterrupt:
+        print("Stopped watching.")
+
+
+def main() -> None:
+    arguments = argparse.ArgumentParser(description="Updates BotC Guide.html from BotC.txt.")
+    arguments.add_argument('--jobs', type=int, default=1, metavar='N', help="render sections across N processes")
+    arguments.add_argument('--deploy', action='store_true', help=f"also write {MINIFIED_FILE} and compressed copies of both guides")
+    arguments.add_argument('--pages', action='store_true', help="also write a page for each character into " + PAGES_DIR)
+    arguments.add_argument('--payload', action='store_true', help=f"also write {PAYLOAD_FILE}, which renders its nodes from JSON as they are needed")
+    arguments.add_argument('--check-payload', action='store_true', help=f"check the text of the nodes in {PAYLOAD_FILE} against {RESULT_FILE} and stop")
+    arguments.add_argument('--dedupe-report', action='store_true', help=f"also list questions asked more than once in {DEDUPE_REPORT_FILE}")
+    arguments.add_argument('--export-db', action='store_true', help=f"also export the nodes to {DATABASE_FILE} for --query and other tools")
+    arguments.add_argument('--watch', action='store_true', help="keep running and rebuild whenever " + BOTC_DATA_FILE + " is saved")
+    arguments.add_argument('--serve', action='store_true', help="keep running, answer searches over HTTP and rebuild whenever " + BOTC_DATA_FILE + " is saved")
+    arguments.add_argument('--host', default="127.0.0.1", help="the address --serve listens on")
+    arguments.add_argument('--port', type=int, default=SERVE_PORT, help="the port --serve listens on")
+    arguments.add_argument('--profile', action='store_true', help="print the time and memory used by each stage")
+    arguments.add_argument('--profile-json', metavar='PATH', help="also save the stage timings as JSON")
+    arguments.add_argument('--memory-budget', type=float, metavar='MB', help="fail if the build's peak resident memory goes over MB")
+    arguments.add_argument('--lint', action='store_true', help="check " + BOTC_DATA_FILE + " for every problem that can be found without building, and stop")
+    arguments.add_argument('--list-backups', action='store_true', help=f"list the backups of {RESULT_FILE} in {BACKUP_DIR} and stop")
+    arguments.add_argument('--restore', metavar='TIMESTAMP', help=f"put the backup of {RESULT_FILE} from TIMESTAMP back and stop")
+    arguments.add_argument('--query', metavar='TERMS', help=f"print the nodes in {DATABASE_FILE} matching TERMS, as in the search box, e.g. 'A, B | C', and stop")
+    options = arguments.parse_args()
+    profiler = StageProfiler(options.profile or options.profile_json is not None)
+
+    if options.lint:
+        if not run_lint(BOTC_DATA_FILE):
+            sys.exit(1)
+        return
+    if options.list_backups:
+        list_backups()
+        return
+    if options.restore:
+        if not restore_backup(options.restore, RESULT_FILE):
+            sys.exit("  Oh dear!")
+        return
+    if options.check_payload:
+        if not check_payload_page(PAYLOAD_FILE, RESULT_FILE):
+            sys.exit(1)
+        return
+    if options.query is not None:
+        if not run_query(DATABASE_FILE, options.query):
+            sys.exit(1)
+        return
 
-    for line in html.split('\n'):
-        if found_start:
-            updated_content.append(" " * 6 + line)
-        else:
-            if line.strip().startswith("var keywords = {"):
-                found_start = True
-            updated_content.append(line)
-        if line.startswith("};"):
-            found_start = False
-    return "\n".join(updated_content)
-
-
-def indent(html: str, output_path: str) -> str:
-    nicely_indented = str(yattag_indent(html))
-    fixed_spans = nicely_indented.replace("</span><span", "</span> <span")
-    fixed_escaping = use_html_entities(fixed_spans)
-    updated_content = indent_keywords(fixed_escaping)
-
-    debug(updated_content, output_path)
-    return updated_content
-
-# Replaces underscores around words with <em></em> tag
-def emphasise(html_content: str, output_path: str) -> str:
-    # Match all the text between a pair of underscores
-    pattern = r'_(\S(?:.*?\S)?)_'
-    
-    # Replace matches with <em> tags
-    modified_html = re.sub(pattern, r'<em>\1</em>', html_content)
-
-    debug(modified_html, output_path)
-    return modified_html
-
-# Crudely removes blanks lines
-def remove_blank_lines(html: str, output_path: str) -> str:
-    lines = html.split("\n")
-    result = []
-    script_encountered = False  # skip JavaScript
-    for line in lines:
-        if not script_encountered:
-            if line.strip():  # Check if line is not blank
-                result.append(line)
-            if line.strip().startswith("<script>"):
-                script_encountered = True
-        else:
-            result.append(line)
+    print("Starting update.")
 
-    deblanked_content = "\n".join(result)
-    debug(deblanked_content, output_path)
-    return deblanked_content
+    print("Checking for input files")
+    if not sanity_check(options.payload):
+        sys.exit("  Oh dear!")
 
+    print("Checking " + TEMPLATE_FILE)
+    with profiler.stage("load_template"):
+        template = load_template(TEMPLATE_FILE)
+    with profiler.stage("check_template"):
+        if not check_template(template):
+            sys.exit("  Oh dear!")
 
-def remove_empty_paragraphs(html: str, output_path: str) -> str:
-    lines = html.split("\n")
-    result = []
 
-    for line in lines:
-      if not line.strip().startswith("<p></p>"):
-        result.append(line)
 
-    content = "\n".join(result)
-    debug(content, output_path)
-    return content
+    if DEBUG_MODE and os.path.exists(RESULT_FILE):
+        print("Backing up ...")
+        manage_backups(RESULT_FILE)
 
+    cache = BuildCache(BUILD_CACHE_FILE, keywords_hash())
+    found_terms = {} if options.watch or options.serve else None   # only worth keeping between rebuilds
+    server = GuideServer() if options.serve else None
+    if not build(template, cache, found_terms, options, profiler, options.jobs, server and server.load):
+        sys.exit("  Oh dear!")
+    rss = peak_rss()
+    if options.memory_budget is not None and rss is not None and rss > options.memory_budget * 2**20:
+        sys.exit(f"  Over the memory budget of {options.memory_budget:g} MB, oh dear!")
 
-def reorder_nodes(input_html: str, output_path: str) -> str:
-    soup = BeautifulSoup(input_html, 'html.parser')
+    if options.serve:
+        # Rebuilds run on a thread of their own, and searches are answered from the last build until they finish
+        rebuild = lambda: build(template, cache, found_terms, options, profiler, 1, server.load)
+        threading.Thread(target=watch, args=(BOTC_DATA_FILE, rebuild), daemon=True).start()
+        server.run(options.host, options.port)
+    elif options.watch:
+        # The template, keyword matchers, build cache and keyword index stay warm between rebuilds,
+        # which only parse BotC.txt again and render the blocks that changed
+        watch(BOTC_DATA_FILE, lambda: build(template, cache, found_terms, options, profiler, 1))
 
-    main = soup.find('main')
-    nodes = main.find_all('div', class_='node')
-    node_counts = []
+    print("Done updating.")
 
-    # Count spans for each node
-    for node in nodes:
-        unique_spans = set()
-        spans = node.find_all('span', class_=['Townsfolk', 'Outsider', 'Minion', 'Demon', 'Fabled', 'Traveller'])
-        for span in spans:
-            unique_spans.add(str(span))
-        unique_count = len(unique_spans)
-        node_counts.append((node, unique_count))
-
-    # Sort nodes based on the count (ascending order)
-    node_counts.sort(key=lambda x: x[1])
-
-    # Clear existing nodes in main and append sorted nodes
-    main.clear()
-    for node, count in node_counts:
-        main.append(node)
-
-    content = str(soup)
-    debug(content, output_path)
-    return content
-
-
-# List of keywords to highlight
-Townsfolk  = [ "Acrobat", "Alchemist", "Alsaahir", "Amnesiac"]
-Townsfolk += [ "Artist", "Atheist", "Balloonist", "Banshee"]
-Townsfolk += [ "Bounty Hunter", "Cannibal", "Chambermaid"]
-Townsfolk += [ "Chef", "Choirboy", "Clockmaker"]
-Townsfolk += [ "Courtier", "Cult Leader", "Dreamer", "Empath"]
-Townsfolk += [ "Engineer", "Exorcist", "Farmer", "Fisherman"]
-Townsfolk += [ "Flowergirl", "Fool", "Fortune Teller"] 
-Townsfolk += [ "Gambler", "General", "Gossip", "Grandmother"]
-Townsfolk += [ "High Priestess", "Huntsman"]
-Townsfolk += [ "Innkeeper", "Investigator", "Juggler"]
-Townsfolk += [ "King", "Knight", "Librarian", "Lycanthrope"]
-Townsfolk += [ "Magician", "Mathematician", "Mayor"]
-Townsfolk += [ "Minstrel", "Monk"]
-Townsfolk += [ "Nightwatchman", "Noble", "Oracle"]
-Townsfolk += [ "Pacifist", "Philosopher", "Pixie" ]
-Townsfolk += [ "Poppy Grower", "Preacher", "Princess", "Professor"]
-Townsfolk += [ "Ravenkeeper", "Sage", "Sailor"]
-Townsfolk += [ "Savant", "Seamstress", "Shugenja"]
-Townsfolk += [ "Slayer", "Soldier", "Snake Charmer"]
-Townsfolk += [ "Steward", "Tea Lady", "Town Crier"]
-Townsfolk += [ "Undertaker", "Village Idiot", "Virgin", "Washerwoman"]
-
-Outsider   = [ "Barber", "Butler"]
-Outsider  += [ "Damsel", "Drunk", "Golem"]
-Outsider  += [ "Goon", "Hatter", "Heretic", "Hermit"]
-Outsider  += [ "Klutz", "Lunatic", "Moonchild", "Mutant", "Ogre"]
-Outsider  += [ "Plague Doctor", "Politician", "Puzzlemaster", "Recluse"]
-Outsider  += [ "Saint", "Snitch", "Sweetheart", "Tinker", "Zealot"]
-
-Minion     = [ "Assassin", "Baron", "Boffin", "Boomdandy", "Cerenovus"]
-Minion    += [ "Devil's Advocate", "Evil Twin", "Fearmonger"]
-Minion    += [ "Goblin", "Godfather", "Harpy"]
-Minion    += [ "Marionette", "Mastermind", "Mezepheles"]
-Minion    += [ "Organ Grinder" ]
-Minion    += [ "Pit-Hag", "Poisoner","Psychopath"]
-Minion    += [ "Scarlet Woman", "Spy",  "Summoner"]
-Minion    += [ "Vizier", "Widow", "Witch", "Wizard", "Wraith", "Xaan"]
-
-Demon      = [ "Al-Hadikhia", "Fang Gu", "Imp", "Kazali"]
-Demon     += [ "Legion", "Leviathan", "Lil' Monsta", "Lleech"]
-Demon     += [ "Lord of Typhon", "No Dashii", "Ojo", "Po", "Pukka"]
-Demon     += [ "Riot", "Shabaloth"]
-Demon     += [ "Vigormortis", "Vortox", "Yaggababble", "Zombuul"]
-
-Traveller  = [ "Apprentice", "Barista", "Beggar", "Bishop"]
-Traveller += [ "Bone Collector", "Bureaucrat", "Butcher"]
-Traveller += [ "Cacklejack", "Deviant"]
-Traveller += [ "Gangster", "Gnome", "Gunslinger", "Harlot"]
-Traveller += [ "Judge", "Matron"]
-Traveller += [ "Scapegoat", "Thief", "Voudon"]
-
-Fabled     = [ "Angel", "Buddhist", "Deus Ex Fiasco"]
-Fabled    += [ "Djinn", "Doomsayer", "Duchess"]
-Fabled    += [ "Ferryman", "Fibbin", "Fiddler"]
-Fabled    += [ "Hell's Librarian", "Revolutionary", "Sentinel"]
-Fabled    += [ "Spirit of Ivory", "Toymaker"]
-
-Loric      = [ "Big Wig", "Bootlegger", "Gardener"]
-Loric     += [ "Hindu", "Pope", "Storm Catcher"]
-Loric     += [ "Tor", "Ventriloquist", "Zenomancer"]
-
-
-
-# All the keywords that are not the names of characters
-# character types
-Extra  = [ "demon", "minion", "townsfolk", "outsider", "fabled", "loric", "traveller"]
-# conditions
-Extra += [ "poison", "drunk", "droisoned", "sober", "healthy"] 
-Extra += [ "good", "evil", "alive", "dead"]
-# concepts
-Extra += [ "nomination | nominate","execution | execute | executing", "exile"]
-Extra += [ "register | registration", "vote | voting" ]
-Extra += [ "alignment", "jinx", "resurrect", "regurgitate | regurgitation"]
-Extra += [ "madness", "setup", "protect" ]
-Extra += [ "in play", "out of play", "bluff", "mid game"]
-Extra += [ "Teensyville", "grimoire", "storyteller | ST" ]
-
-all_the_words = {"Townsfolk":[ {"Preacher":"Preacher | preach",
-                                "Dreamer":"Dreamer | dream",
-                                "Grandmother":"Grandmother | grandchild",
-                                "Snake Charmer":"Snake Charmer | snake charmed",
-                                "Lycanthrope":"Lycanthrope | faux paw",
-                                "Fortune Teller":"Fortune Teller | red herring",
-                                "Exorcist":"Exorcist | exorcise | exorcism"}.get(item, item) for item in Townsfolk],
-                 "Outsider":Outsider,
-                 "Minion":[ {"Evil Twin":"Evil Twin | Good Twin | the Twins",
-                             "Summoner":"Summoner | summon",
-                             "Xaan":"Xaan | night X"}.get(item, item) for item in Minion],
-                 "Demon":[ {"Lil' Monsta":"Lil' Monsta | babysit"}.get(item, item) for item in Demon],
-                 "Traveller":[ {"Bone Collector":"Bone Collector | bone collect"}.get(item, item) for item in Traveller],
-                 "Fabled":[ {"Doomsayer":"Doomsayer | doomsay"}.get(item, item) for item in Fabled],
-                 "Extra":[ {"Storyteller":"Storyteller | ST"}.get(item, item) for item in Extra],
-                 "Loric": [ {"Storm Catcher":"Storm Catcher | storm caught"}.get(item, item) for item in Loric]
-                 }
-
-print("Starting update.")
-
-print("Checking for input files")
-if not sanity_check():
-    sys.exit("  Oh dear!")
-
-print("Checking " + BOTC_DATA_FILE)
-if not check_file_format(BOTC_DATA_FILE):
-    sys.exit("  Oh dear!")
-
-
-print("Checking " + RESULT_FILE)
-if not check_output_file_format(RESULT_FILE):
-    sys.exit("  Oh dear!")
-
-
-
-if DEBUG_MODE:
-    print("Backing up ...")
-    manage_backups(RESULT_FILE)
-
-print("Nodifying text ...")
-nodes = text_to_nodes(BOTC_DATA_FILE, 'nodefied content.txt')
-
-print("Placing updated nodes in guide ...")
-interim_result = replace_nodes(RESULT_FILE, nodes, 'nodified content.html')
-
-print("Highlighting characters ...")
-interim_result = highlight_roles(interim_result, 'highlighted.html')
-print("  Done highlighting.                                                              ")
-
-print("Ordering nodes ...")
-interim_result = reorder_nodes(interim_result, 'reordered_nodes.html')
-
-print("Updating index ...")
-interim_result = update_index(interim_result, 'updated index.html')
-
-print("Removing excess blank lines ...")
-interim_result = remove_blank_lines(interim_result, "removed_blank_lines.html")
-
-print("Prettifying ...")
-interim_result = indent(interim_result, 'pretty.html')
-
-print("Adding emphasis ...")
-interim_result = emphasise(interim_result, "emphasised.html")
-
-print("Removing blank paragraphs ...")
-interim_result = remove_empty_paragraphs(interim_result, "removed_empty_paragraphs.html")
+    if options.profile:
+        print("Stage timings (memory traced with tracemalloc, which slows everything down):")
+        print(profiler.table())
+    if options.profile_json:
+        profiler.save(options.profile_json)
 
-print("Saving updated guide ...")
-with open(RESULT_FILE, 'w', encoding='utf-8') as output:
-    output.write(interim_result)
 
-print("Done updating.")
\ No newline at end of file
+if __name__ == "__main__":
+    main()